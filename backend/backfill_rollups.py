@@ -0,0 +1,21 @@
+"""Rebuild the sales_rollups collection from all stored barcode orders.
+
+Run offline (with the API stopped) after deploying rollups or to repair them:
+
+    python backfill_rollups.py
+"""
+import asyncio
+
+import server
+
+
+async def main():
+    await server.db.sales_rollups.create_index([("day", 1), ("barcode_type", 1), ("state", 1)])
+    await server.backfill_sales_rollups()
+    buckets = await server.db.sales_rollups.count_documents({})
+    print(f"Rebuilt {buckets} sales rollup buckets")
+    server.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+"""Worker process for distributed order processing.
+
+Claims chunks queued by POST /api/process-order/{order_id}/distributed, renders
+them into partial archives and finalizes orders once all of their chunks are
+done. Start as many as needed, on one machine or on several nodes sharing the
+same MongoDB and ARTIFACT_DIR:
+
+    python chunk_worker.py --processes 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+
+import server
+
+
+async def run_worker(exit_when_idle: bool):
+    server.start_email_delivery()
+    worker = server.ChunkWorker()
+    server.logger.info(f"Chunk worker {worker.worker_id} started")
+    try:
+        await server.ensure_chunk_indexes()
+        await worker.run(exit_when_idle=exit_when_idle)
+    finally:
+        await server.stop_email_delivery()
+        server.client.close()
+
+
+def worker_main(exit_when_idle: bool):
+    asyncio.run(run_worker(exit_when_idle))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process queued order chunks")
+    parser.add_argument("--processes", type=int, default=1, help="number of worker processes to start")
+    parser.add_argument("--exit-when-idle", action="store_true", help="stop once no chunk is left to process")
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        worker_main(args.exit_when_idle)
+        return
+
+    # Spawn fresh interpreters so no Mongo client state is inherited across fork
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=worker_main, args=(args.exit_when_idle,))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
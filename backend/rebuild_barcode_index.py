@@ -0,0 +1,21 @@
+"""Rebuild the memory-mapped barcode index from the order manifests in ARTIFACT_DIR.
+
+Use it to repair the index or to compact it in one pass:
+
+    python rebuild_barcode_index.py
+"""
+import server
+
+
+def main():
+    manifests = {
+        path.parent.name: path
+        for path in server.ARTIFACT_DIR.glob("*/barcodes_*.manifest.parquet")
+        if path.name == server.manifest_filename(path.parent.name)
+    }
+    server.barcode_index.rebuild(manifests)
+    print(f"Indexed barcodes of {len(manifests)} orders")
+
+
+if __name__ == "__main__":
+    main()
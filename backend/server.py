@@ -1,17 +1,25 @@
-from fastapi import FastAPI, APIRouter, HTTPException, File, UploadFile
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, HTTPException, File, UploadFile, Request, Query
+from fastapi.responses import StreamingResponse, FileResponse, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure, PyMongoError
 import os
+import asyncio
 import logging
+import queue
+import time
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
+import orjson
 import zipfile
+import tarfile
+import zstandard
 import io
 import base64
 import smtplib
@@ -22,11 +30,21 @@ from email import encoders
 import openpyxl
 from openpyxl import Workbook
 import barcode
-from barcode.writer import ImageWriter, SVGWriter
+from barcode.writer import ImageWriter, SVGWriter, mm2px, pt2mm
 import qrcode
-from PIL import Image
+from PIL import Image, ImageDraw, ImageFont
 import tempfile
 import shutil
+import threading
+import functools
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import fcntl
+import hashlib
+import numpy as np
+import pandas as pd
 
 
 ROOT_DIR = Path(__file__).parent
@@ -38,7 +56,7 @@ client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -66,6 +84,10 @@ class BarcodeOrder(BaseModel):
     final_amount: float
     order_status: str = "pending"  # pending, processing, completed, failed
     payment_status: str = "pending"  # pending, paid, failed
+    progress: int = 0  # number of barcodes rendered so far
+    email_status: Optional[str] = None  # queued, sent, failed
+    completed_at: Optional[datetime] = None  # first successful processing
+    payload_source: str = "generated"  # generated, upload
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -117,45 +139,199 @@ def calculate_tax_and_total(base_amount: float, state: str) -> Dict[str, float]:
             "total_amount": base_amount + tax_amount
         }
 
-def generate_barcode_data(barcode_type: str, quantity: int) -> List[Dict]:
-    """Generate barcode data based on type and quantity"""
+def generate_barcode_data(barcode_type: str, quantity: int, payloads: Optional[List[str]] = None) -> List[Dict]:
+    """Generate barcode data based on type and quantity, encoding customer payloads when given"""
     barcodes = []
+    if payloads is not None:
+        quantity = len(payloads)
     for i in range(quantity):
         barcode_id = f"{barcode_type.upper()}{str(uuid.uuid4())[:8]}"
         barcodes.append({
             "id": barcode_id,
             "type": barcode_type,
-            "data": barcode_id,
+            "data": payloads[i] if payloads is not None else barcode_id,
             "generated_at": datetime.utcnow().isoformat()
         })
     return barcodes
 
-def create_barcode_image(barcode_data: str, barcode_type: str) -> str:
-    """Generate barcode image and return as base64"""
-    try:
+# Barcode Rendering
+# Images render on a pool of RENDER_WORKERS spawned processes, started once per API
+# or chunk_worker.py process and kept warm. Every worker holds its own interpreter,
+# fonts and glyph cache, so the default stays small instead of following the CPU
+# count; raise it on dedicated render hosts, or set 0 to render in threads.
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "2"))
+RENDER_WORKER_MAX_TASKS = int(os.environ.get("RENDER_WORKER_MAX_TASKS", "200"))  # recycle workers after N batches
+RENDER_BATCH_SIZE = 64
+RENDER_WARMUP_TEXT = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+@functools.lru_cache(maxsize=None)
+def load_font(path: str, size: int):
+    return ImageFont.truetype(path, size)
+
+@functools.lru_cache(maxsize=None)
+def is_monospaced_font(path: str, size: int) -> bool:
+    font = load_font(path, size)
+    return len({font.getlength(char) for char in RENDER_WARMUP_TEXT + "il -"}) == 1
+
+class CachedImageWriter(ImageWriter):
+    """ImageWriter that loads each font once and draws the text line from cached glyphs.
+
+    The stock writer opens the TrueType font for every image and lays out the text
+    line with FreeType each time. With a monospaced font every glyph has the same
+    advance, so the line can be composed from per-character bitmaps rendered once.
+    """
+
+    glyph_cache: Dict[tuple, tuple] = {}
+
+    def _glyph(self, font, font_size: int, char: str) -> tuple:
+        key = (self.font_path, font_size, char)
+        glyph = self.glyph_cache.get(key)
+        if glyph is None:
+            ascent, descent = font.getmetrics()
+            advance = int(round(font.getlength(char)))
+            tile = Image.new("L", (max(advance, 1), ascent + descent), 0)
+            ImageDraw.Draw(tile).text((0, 0), char, font=font, fill=255, anchor="la")
+            glyph = self.glyph_cache[key] = (tile, advance, ascent, descent)
+        return glyph
+
+    def _paint_text(self, xpos, ypos):
+        barcodetext = self.human if self.human != "" else self.text
+        
+        font_size = int(mm2px(pt2mm(self.font_size), self.dpi))
+        if font_size <= 0:
+            return
+        font = load_font(self.font_path, font_size)
+        monospaced = is_monospaced_font(self.font_path, font_size)
+        for subtext in barcodetext.split("\n"):
+            x, y = mm2px(xpos, self.dpi), mm2px(ypos, self.dpi)
+            if monospaced and subtext.isascii():
+                # Place the line where ImageDraw.text() puts anchor "md": FreeType works in 1/64 px,
+                # rounding x and half the line width half up and the descender line y half down
+                left = (round(x * 64) + 32) // 64 - (round(font.getlength(subtext) * 64) // 2 + 32) // 64
+                bottom = (round(y * 64) + 31) // 64
+                for char in subtext:
+                    tile, advance, ascent, descent = self._glyph(font, font_size, char)
+                    self._image.paste(self.foreground, (left, bottom - descent - ascent), tile)
+                    left += advance
+            else:
+                self._draw.text((x, y), subtext, font=font, fill=self.foreground, anchor="md")
+            ypos += pt2mm(self.font_size) / 2 + self.text_line_distance
+
+class BarcodeRenderer:
+    """Per-thread renderer holding pre-loaded symbology classes and a reusable writer"""
+
+    def __init__(self):
+        self.writer = CachedImageWriter()
+        self.symbologies = {}
+        for barcode_type in BARCODE_TYPES:
+            if barcode_type == "qr_code":
+                continue
+            try:
+                self.symbologies[barcode_type] = barcode.get_barcode_class(barcode_type)
+            except barcode.errors.BarcodeNotFoundError:
+                pass
+
+    def warm_up(self):
+        """Render one sample per symbology so fonts, glyphs and codecs are ready"""
+        samples = {"ean13": "400638133393", "upc": "03600029145", "code39": RENDER_WARMUP_TEXT}
+        self.render(RENDER_WARMUP_TEXT, "qr_code")
+        for barcode_type in self.symbologies:
+            self.render(samples.get(barcode_type, RENDER_WARMUP_TEXT), barcode_type)
+
+    def render(self, barcode_data: str, barcode_type: str) -> bytes:
+        buffer = io.BytesIO()
         if barcode_type == "qr_code":
             qr = qrcode.QRCode(version=1, box_size=10, border=5)
             qr.add_data(barcode_data)
             qr.make(fit=True)
             img = qr.make_image(fill_color="black", back_color="white")
-            
-            # Convert to base64
-            buffer = io.BytesIO()
             img.save(buffer, format='PNG')
-            img_str = base64.b64encode(buffer.getvalue()).decode()
-            return img_str
         else:
             # For other barcode types, use python-barcode
-            code_class = barcode.get_barcode_class(barcode_type)
-            code = code_class(barcode_data, writer=ImageWriter())
-            
-            buffer = io.BytesIO()
+            code_class = self.symbologies.get(barcode_type) or barcode.get_barcode_class(barcode_type)
+            code = code_class(barcode_data, writer=self.writer)
             code.write(buffer)
-            img_str = base64.b64encode(buffer.getvalue()).decode()
-            return img_str
+        return buffer.getvalue()
+
+render_state = threading.local()
+
+def get_renderer() -> BarcodeRenderer:
+    """The calling thread's renderer; writers keep per-image state so they are not shared"""
+    renderer = getattr(render_state, "renderer", None)
+    if renderer is None:
+        renderer = render_state.renderer = BarcodeRenderer()
+    return renderer
+
+def render_barcode_png(barcode_data: str, barcode_type: str) -> bytes:
+    """Generate a barcode image as PNG bytes, or b"" if it cannot be rendered"""
+    try:
+        return get_renderer().render(barcode_data, barcode_type)
     except Exception as e:
         print(f"Error generating barcode: {e}")
-        return ""
+        return b""
+
+def create_barcode_image(barcode_data: str, barcode_type: str) -> str:
+    """Generate barcode image and return as base64"""
+    return base64.b64encode(render_barcode_png(barcode_data, barcode_type)).decode()
+
+def init_render_worker():
+    """Process pool initializer: build and warm the worker's renderer before it takes tasks"""
+    get_renderer().warm_up()
+
+def render_barcode_batch(items: List[tuple]) -> List[bytes]:
+    """Render (data, type) pairs; runs inside render pool workers"""
+    return [render_barcode_png(barcode_data, barcode_type) for barcode_data, barcode_type in items]
+
+render_pool: Optional[ProcessPoolExecutor] = None
+
+def get_render_pool() -> Optional[ProcessPoolExecutor]:
+    """Shared pool of warm render processes, recycled after RENDER_WORKER_MAX_TASKS batches"""
+    global render_pool
+    if render_pool is None and RENDER_WORKERS > 0:
+        render_pool = ProcessPoolExecutor(
+            max_workers=RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_render_worker,
+            max_tasks_per_child=RENDER_WORKER_MAX_TASKS
+        )
+    return render_pool
+
+def shutdown_render_pool():
+    global render_pool
+    if render_pool is not None:
+        render_pool.shutdown(wait=False, cancel_futures=True)
+        render_pool = None
+
+async def render_barcodes(barcode_list: List[Dict]):
+    """Yield (barcode, png) in order while batches render concurrently on the render pool"""
+    loop = asyncio.get_running_loop()
+    pool = get_render_pool()
+    max_in_flight = 2 * max(RENDER_WORKERS, 1)
+    pending = collections.deque()
+    next_start = 0
+    try:
+        while next_start < len(barcode_list) or pending:
+            while next_start < len(barcode_list) and len(pending) < max_in_flight:
+                batch = barcode_list[next_start:next_start + RENDER_BATCH_SIZE]
+                items = [(bc['data'], bc['type']) for bc in batch]
+                if pool is not None:
+                    future = loop.run_in_executor(pool, render_barcode_batch, items)
+                else:
+                    future = asyncio.ensure_future(asyncio.to_thread(render_barcode_batch, items))
+                pending.append((batch, future))
+                next_start += len(batch)
+            batch, future = pending.popleft()
+            for bc, png in zip(batch, await future):
+                yield bc, png
+    except BrokenProcessPool:
+        # A worker died; release the broken pool so the next order starts a fresh one,
+        # unless a concurrent order already replaced it
+        if render_pool is pool:
+            shutdown_render_pool()
+        raise
+    finally:
+        for _, future in pending:
+            future.cancel()
 
 def create_invoice_data(order: BarcodeOrder, tax_details: Dict) -> Dict:
     """Create invoice data structure with INR currency"""
@@ -174,6 +350,1383 @@ def create_invoice_data(order: BarcodeOrder, tax_details: Dict) -> Dict:
         "date": order.created_at.strftime("%Y-%m-%d")
     }
 
+# Response Serialization
+# Mongo ObjectIds and internal bookkeeping fields are never exposed through the API
+ORDER_PROJECTION = {
+    "_id": 0,
+    "processing_mode": 0,
+    "finalize_owner": 0,
+    "finalize_lease_expires": 0,
+    "email_lease_expires": 0
+}
+
+def json_response(content: Any, status_code: int = 200) -> ORJSONResponse:
+    """Serialize content with orjson directly, bypassing FastAPI's jsonable_encoder pass"""
+    return ORJSONResponse(content, status_code=status_code)
+
+# Sales Rollups
+ROLLUP_COUNTERS = ["orders", "units", "revenue", "tax", "completed_orders", "completed_units"]
+ROLLUP_DIMENSIONS = ["day", "barcode_type", "state"]
+
+def rollup_state(state: Optional[str]) -> str:
+    """Normalize a customer state into a rollup bucket name"""
+    return (state or "other").strip().lower() or "other"
+
+async def increment_sales_rollup(day: str, barcode_type: str, state: Optional[str], counters: Dict[str, float]):
+    """Atomically add counters to the day/type/state sales bucket"""
+    state = rollup_state(state)
+    try:
+        await db.sales_rollups.update_one(
+            {"_id": f"{day}|{barcode_type}|{state}"},
+            {
+                "$inc": counters,
+                "$setOnInsert": {"day": day, "barcode_type": barcode_type, "state": state}
+            },
+            upsert=True
+        )
+    except PyMongoError as e:
+        # Rollups can be rebuilt with backfill_rollups.py, so never fail the order over them
+        logger.error(f"Failed to update sales rollup {day}/{barcode_type}/{state}: {e}")
+
+async def record_order_created(order: BarcodeOrder):
+    await increment_sales_rollup(
+        order.created_at.strftime("%Y-%m-%d"),
+        order.barcode_type,
+        order.customer_details.state,
+        {"orders": 1, "units": order.quantity, "revenue": order.final_amount, "tax": order.tax_amount}
+    )
+
+async def record_order_completed(order: BarcodeOrder, completed_at: datetime):
+    await increment_sales_rollup(
+        completed_at.strftime("%Y-%m-%d"),
+        order.barcode_type,
+        order.customer_details.state,
+        {"completed_orders": 1, "completed_units": order.quantity}
+    )
+
+# Aggregation equivalent of rollup_state()
+ROLLUP_STATE_EXPRESSION = {"$let": {
+    "vars": {"state": {"$toLower": {"$trim": {"input": {"$ifNull": ["$customer_details.state", ""]}}}}},
+    "in": {"$cond": [{"$eq": ["$$state", ""]}, "other", "$$state"]}
+}}
+
+async def backfill_sales_rollups():
+    """Rebuild sales_rollups from every stored order.
+
+    Meant to run offline: orders created or completed while it runs may be
+    counted twice or not at all.
+    """
+    # Orders completed before completed_at was recorded are dated by their last update.
+    # Store that date so complete_order() does not count them again if they are reprocessed.
+    await db.barcode_orders.update_many(
+        {"order_status": "completed", "completed_at": None},
+        [{"$set": {"completed_at": "$updated_at"}}]
+    )
+    await db.sales_rollups.delete_many({})
+    sources = [
+        ("$created_at", {}, {
+            "orders": {"$sum": 1},
+            "units": {"$sum": "$quantity"},
+            "revenue": {"$sum": "$final_amount"},
+            "tax": {"$sum": "$tax_amount"}
+        }),
+        # Like complete_order(), count every order that completed at least once
+        ("$completed_at", {"completed_at": {"$ne": None}}, {
+            "completed_orders": {"$sum": 1},
+            "completed_units": {"$sum": "$quantity"}
+        }),
+    ]
+    for date_field, match, sums in sources:
+        group_id = {
+            "day": {"$dateToString": {"format": "%Y-%m-%d", "date": date_field}},
+            "barcode_type": "$barcode_type",
+            "state": ROLLUP_STATE_EXPRESSION
+        }
+        pipeline = [
+            {"$match": match},
+            {"$group": dict({"_id": group_id}, **sums)},
+            {"$project": dict(
+                {
+                    "_id": {"$concat": ["$_id.day", "|", "$_id.barcode_type", "|", "$_id.state"]},
+                    "day": "$_id.day",
+                    "barcode_type": "$_id.barcode_type",
+                    "state": "$_id.state"
+                },
+                **{counter: 1 for counter in sums}
+            )},
+            {"$merge": {"into": "sales_rollups", "whenMatched": "merge", "whenNotMatched": "insert"}}
+        ]
+        await db.barcode_orders.aggregate(pipeline).to_list(None)
+
+def build_barcode_workbook(barcode_list: List[Dict]) -> bytes:
+    """Create the barcode_data.xlsx sheet listing every barcode of an order"""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Barcode_Data"
+    
+    # Headers
+    ws['A1'] = "Barcode ID"
+    ws['B1'] = "Type"
+    ws['C1'] = "Data"
+    ws['D1'] = "Generated At"
+    
+    # Add barcode data
+    for idx, bc in enumerate(barcode_list, 2):
+        ws[f'A{idx}'] = bc['id']
+        ws[f'B{idx}'] = bc['type']
+        ws[f'C{idx}'] = bc['data']
+        ws[f'D{idx}'] = bc['generated_at']
+    
+    excel_buffer = io.BytesIO()
+    wb.save(excel_buffer)
+    return excel_buffer.getvalue()
+
+def build_invoice_json(order: BarcodeOrder) -> str:
+    """Create the invoice.json contents for an order"""
+    state = order.customer_details.state or "other"
+    tax_details = calculate_tax_and_total(order.total_amount, state)
+    return json.dumps(create_invoice_data(order, tax_details), indent=2)
+
+# Order Status Events
+ORDER_EVENT_FIELDS = {"_id": 0, "id": 1, "order_status": 1, "progress": 1, "quantity": 1, "updated_at": 1}
+FINAL_ORDER_STATUSES = {"completed", "failed"}
+STATUS_POLL_INTERVAL = float(os.environ.get("STATUS_POLL_INTERVAL", "1.0"))
+SSE_HEARTBEAT_INTERVAL = 15.0
+PROGRESS_UPDATE_STEP = 0.05  # persist progress every 5% of an order
+CHANGE_STREAM_UNSUPPORTED_CODES = {40573}  # "$changeStream stage is only supported on replica sets"
+
+class OrderStatusBroadcaster:
+    """Fan out order status changes from one shared watcher to many subscribers.
+
+    A single MongoDB change stream feeds every connected client. On a standalone
+    server (no replica set) change streams are unavailable, so the watcher falls
+    back to one batched poll per interval covering all watched orders.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.subscribers: Dict[str, set] = {}
+        self.last_seen: Dict[str, tuple] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.mode = "idle"
+
+    def subscribe(self, order_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        self.subscribers.setdefault(order_id, set()).add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, order_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(order_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[order_id]
+            self.last_seen.pop(order_id, None)
+
+    def publish(self, event: Dict):
+        """Deliver the latest state to every subscriber of the order, dropping stale states"""
+        order_id = event.get("id")
+        if order_id not in self.subscribers:
+            return
+        key = (event.get("order_status"), event.get("progress"))
+        if self.last_seen.get(order_id) == key:
+            return
+        self.last_seen[order_id] = key
+        for queue in self.subscribers[order_id]:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                if self.mode == "polling":
+                    await self._poll()
+                else:
+                    await self._watch()
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAM_UNSUPPORTED_CODES:
+                    logger.info(f"Change streams unavailable, polling order status: {e}")
+                    self.mode = "polling"
+                    continue
+                # Auth errors, lost resume history, elections: keep using the change stream
+                logger.warning(f"Order status change stream failed, reopening: {e}")
+                await asyncio.sleep(STATUS_POLL_INTERVAL)
+            except PyMongoError as e:
+                logger.warning(f"Order status watcher error, retrying: {e}")
+                await asyncio.sleep(STATUS_POLL_INTERVAL)
+
+    async def _watch(self):
+        pipeline = [
+            {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
+            {"$project": {"fullDocument." + field: 1 for field in ORDER_EVENT_FIELDS if field != "_id"}},
+        ]
+        async with self.collection.watch(pipeline, full_document="updateLookup") as stream:
+            self.mode = "change_stream"
+            # Catch up on changes made while the stream was being (re)opened
+            await self._poll_once()
+            async for change in stream:
+                if change.get("fullDocument"):
+                    self.publish(change["fullDocument"])
+
+    async def _poll_once(self):
+        order_ids = list(self.subscribers)
+        if order_ids:
+            cursor = self.collection.find({"id": {"$in": order_ids}}, ORDER_EVENT_FIELDS)
+            async for order in cursor:
+                self.publish(order)
+
+    async def _poll(self):
+        while True:
+            await self._poll_once()
+            await asyncio.sleep(STATUS_POLL_INTERVAL)
+
+order_status_broadcaster = OrderStatusBroadcaster(db.barcode_orders)
+
+def format_sse(event: str, data: Dict) -> str:
+    """Format a Server-Sent Events message"""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+# Artifact Storage
+ARTIFACT_DIR = Path(os.environ.get("ARTIFACT_DIR", ROOT_DIR / "artifacts"))
+
+def artifact_path(order_id: str, filename: str) -> Path:
+    """Path of a stored artifact belonging to an order"""
+    return ARTIFACT_DIR / order_id / filename
+
+def save_artifact(order_id: str, filename: str, data: bytes) -> Path:
+    """Persist an order artifact so it can be downloaded or emailed later"""
+    path = artifact_path(order_id, filename)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_bytes(data)
+    tmp_path.replace(path)
+    return path
+
+# Archive Formats
+ARCHIVE_FORMATS = {
+    "zip-deflate": {"media_type": "application/zip", "suffix": ".zip", "download_suffix": ".zip"},
+    "zip-stored": {"media_type": "application/zip", "suffix": "-stored.zip", "download_suffix": ".zip"},
+    "tar.zst": {"media_type": "application/zstd", "suffix": ".tar.zst", "download_suffix": ".tar.zst"},
+}
+DEFAULT_ARCHIVE_FORMAT = "zip-deflate"
+ACCEPT_ARCHIVE_FORMATS = {
+    "application/zip": "zip-deflate",
+    "application/zstd": "tar.zst",
+    "application/x-zstd-compressed-tar": "tar.zst",
+}
+ZSTD_LEVEL = int(os.environ.get("ZSTD_LEVEL", "3"))
+ZSTD_THREADS = int(os.environ.get("ZSTD_THREADS", "-1"))  # -1 uses every CPU core
+
+class ZipArchiveWriter:
+    """Write archive entries into a ZIP file"""
+
+    def __init__(self, fileobj, compression: int):
+        self.zip_file = zipfile.ZipFile(fileobj, 'w', compression)
+
+    def add(self, name: str, data):
+        self.zip_file.writestr(name, data)
+
+    def close(self):
+        self.zip_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class TarZstArchiveWriter:
+    """Write archive entries into a tar stream compressed by multithreaded zstd"""
+
+    def __init__(self, fileobj, level: int = ZSTD_LEVEL, threads: int = ZSTD_THREADS):
+        compressor = zstandard.ZstdCompressor(level=level, threads=threads)
+        self.stream = compressor.stream_writer(fileobj, closefd=False)
+        self.tar_file = tarfile.open(fileobj=self.stream, mode="w|")
+        self.mtime = time.time()
+
+    def add(self, name: str, data):
+        if isinstance(data, str):
+            data = data.encode()
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = self.mtime
+        self.tar_file.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.tar_file.close()
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_archive_writer(archive_format: str, fileobj):
+    """Create a writer for the given archive format"""
+    if archive_format == "zip-deflate":
+        return ZipArchiveWriter(fileobj, zipfile.ZIP_DEFLATED)
+    if archive_format == "zip-stored":
+        return ZipArchiveWriter(fileobj, zipfile.ZIP_STORED)
+    if archive_format == "tar.zst":
+        return TarZstArchiveWriter(fileobj)
+    raise ValueError(f"Unknown archive format: {archive_format}")
+
+def iter_archive_entries(path: Path, archive_format: str):
+    """Yield (name, data) for every file stored in an archive"""
+    if archive_format == "tar.zst":
+        with open(path, "rb") as raw, zstandard.ZstdDecompressor().stream_reader(raw) as stream:
+            with tarfile.open(fileobj=stream, mode="r|") as tar_file:
+                for member in tar_file:
+                    if member.isfile():
+                        yield member.name, tar_file.extractfile(member).read()
+    else:
+        with zipfile.ZipFile(path) as zip_file:
+            for info in zip_file.infolist():
+                yield info.filename, zip_file.read(info)
+
+def convert_archive(source: Path, source_format: str, target: Path, target_format: str):
+    """Repackage an archive into another format.
+
+    Concurrent conversions of the same archive each write their own temporary
+    file; whichever finishes last replaces the target with identical contents.
+    """
+    if target.is_file():
+        return
+    tmp_path = target.with_name(f"{target.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with open(tmp_path, "wb") as output, open_archive_writer(target_format, output) as writer:
+            for name, data in iter_archive_entries(source, source_format):
+                writer.add(name, data)
+        tmp_path.replace(target)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+def archive_filename(order_id: str, archive_format: str) -> str:
+    return f"barcodes_{order_id}{ARCHIVE_FORMATS[archive_format]['suffix']}"
+
+def archive_download_name(order_id: str, archive_format: str) -> str:
+    return f"barcodes_{order_id}{ARCHIVE_FORMATS[archive_format]['download_suffix']}"
+
+def archive_format_of(path: Path) -> str:
+    """Archive format of a stored order archive, from its filename"""
+    for archive_format, spec in sorted(ARCHIVE_FORMATS.items(), key=lambda item: -len(item[1]["suffix"])):
+        if path.name.endswith(spec["suffix"]):
+            return archive_format
+    raise ValueError(f"Unknown archive: {path.name}")
+
+def find_order_archive(order_id: str) -> Optional[tuple]:
+    """Return (format, path) of a stored archive for the order, if any"""
+    for archive_format in ARCHIVE_FORMATS:
+        path = artifact_path(order_id, archive_filename(order_id, archive_format))
+        if path.is_file():
+            return archive_format, path
+    return None
+
+def remove_order_archives(order_id: str):
+    """Drop every stored archive of an order before it is regenerated"""
+    for archive_format in ARCHIVE_FORMATS:
+        artifact_path(order_id, archive_filename(order_id, archive_format)).unlink(missing_ok=True)
+
+def negotiate_archive_format(requested: Optional[str], accept: Optional[str], default: str) -> str:
+    """Pick the archive format from the format query parameter, then the Accept header"""
+    if requested:
+        if requested not in ARCHIVE_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid archive format, choose one of: {', '.join(ARCHIVE_FORMATS)}"
+            )
+        return requested
+    
+    candidates = []
+    for position, media_range in enumerate((accept or "").split(",")):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type.lower() in ACCEPT_ARCHIVE_FORMATS and quality > 0:
+            candidates.append((-quality, position, ACCEPT_ARCHIVE_FORMATS[media_type.lower()]))
+    if candidates:
+        return min(candidates)[2]
+    return default
+
+# Customer Payload Import
+# Uploaded CSV/XLSX files are parsed in batches of PAYLOAD_BATCH_SIZE rows, each
+# batch validated with vectorized pandas/numpy checks for the order's symbology,
+# and valid payloads streamed to a JSON-lines file in the order's artifact folder
+# that process_order and the chunk workers read instead of generating random IDs.
+PAYLOAD_BATCH_SIZE = 5000
+MAX_REPORTED_ROW_ERRORS = 100
+PAYLOAD_FILENAME = "payloads.jsonl"
+PAYLOAD_COLUMN_NAMES = ["data", "payload", "value", "sku", "url"]
+PAYLOAD_RULES = {
+    "qr_code": {"max_bytes": 2953},
+    "datamatrix": {"max_bytes": 1556},
+    "code128": {"pattern": r"[\x20-\x7e]{1,80}", "message": "must be 1-80 printable ASCII characters"},
+    "code39": {"pattern": r"[0-9A-Z\-. $/+%]{1,43}", "message": "must be 1-43 characters from 0-9, A-Z, space and -.$/+%"},
+    "ean13": {"digits": 12},
+    "upc": {"digits": 11},
+}
+
+def gtin_check_digits(digits: np.ndarray) -> np.ndarray:
+    """Check digits for a 2-D array of GTIN digits (one payload per row, check digit excluded)"""
+    positions = np.arange(digits.shape[1])
+    weights = np.where((digits.shape[1] - positions) % 2 == 1, 3, 1)
+    return (10 - (digits @ weights) % 10) % 10
+
+def validate_payload_batch(barcode_type: str, values: pd.Series) -> tuple:
+    """Normalize a batch of payloads and return (values, errors), errors being None for valid rows.
+
+    Values are strings, or numbers for numeric spreadsheet cells.
+    """
+    rule = PAYLOAD_RULES[barcode_type]
+    numeric_cells = values.map(type).isin([int, float])
+    values = values.fillna("").map(cell_text).str.strip()
+    if barcode_type == "code39":
+        values = values.str.upper()
+    errors = pd.Series(None, index=values.index, dtype=object)
+    errors[values == ""] = "empty value"
+    
+    if "max_bytes" in rule:
+        too_long = values.str.encode("utf-8").str.len() > rule["max_bytes"]
+        errors[too_long & errors.isna()] = f"longer than {rule['max_bytes']} bytes"
+    elif "pattern" in rule:
+        invalid = ~values.str.fullmatch(rule["pattern"]).fillna(False)
+        errors[invalid & errors.isna()] = rule["message"]
+    else:
+        # Spreadsheets drop the leading zeros of numbers, which silently changes the GTIN
+        errors[numeric_cells & errors.isna()] = "stored as a number, which drops leading zeros; store GTINs as text"
+        length = rule["digits"]
+        numeric = values.str.fullmatch(rf"\d{{{length}}}|\d{{{length + 1}}}").fillna(False)
+        errors[~numeric & errors.isna()] = f"must be {length} digits, or {length + 1} including the check digit"
+        with_check = values[numeric & (values.str.len() == length + 1)]
+        if len(with_check):
+            digits = (np.frombuffer("".join(with_check).encode(), dtype=np.uint8) - ord("0")).reshape(-1, length + 1)
+            wrong = gtin_check_digits(digits[:, :length].astype(np.int64)) != digits[:, length]
+            errors[with_check.index[wrong]] = "invalid check digit"
+    return values, errors
+
+def pick_payload_column(header: List[str], column: Optional[str]) -> int:
+    """Position of the payload column: the requested header, a well-known name, or the first column"""
+    names = [str(name).strip() if name is not None else "" for name in header]
+    if column is not None:
+        if column not in names:
+            raise HTTPException(status_code=400, detail=f"Column '{column}' not found in the uploaded file")
+        return names.index(column)
+    for candidate in PAYLOAD_COLUMN_NAMES:
+        for position, name in enumerate(names):
+            if name.lower() == candidate:
+                return position
+    return 0
+
+def cell_text(value) -> str:
+    """Text of a spreadsheet cell, without the .0 Excel adds to whole numbers"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def iter_csv_payload_batches(fileobj, column: Optional[str]) -> Iterator[pd.Series]:
+    """Yield payload batches from a CSV file, indexed by spreadsheet row number"""
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    reader = pd.read_csv(text, dtype=str, keep_default_na=False, skip_blank_lines=False, chunksize=PAYLOAD_BATCH_SIZE)
+    position = None
+    for chunk in reader:
+        if position is None:
+            position = pick_payload_column(list(chunk.columns), column)
+        blank = (chunk == "").all(axis=1)
+        batch = chunk.iloc[:, position][~blank]
+        batch.index = batch.index + 2  # header is row 1
+        yield batch
+    text.detach()
+
+def iter_xlsx_payload_batches(fileobj, column: Optional[str]) -> Iterator[pd.Series]:
+    """Yield payload batches from the first sheet of an XLSX file using openpyxl's read-only mode.
+
+    Cell values are passed on as read, so validation can tell numeric cells from text.
+    """
+    wb = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        position = pick_payload_column(list(header), column)
+        values, row_numbers = [], []
+        for row_number, row in enumerate(rows, 2):
+            if all(cell is None or cell_text(cell).strip() == "" for cell in row):
+                continue
+            values.append(row[position] if position < len(row) else None)
+            row_numbers.append(row_number)
+            if len(values) == PAYLOAD_BATCH_SIZE:
+                yield pd.Series(values, index=row_numbers, dtype=object)
+                values, row_numbers = [], []
+        if values:
+            yield pd.Series(values, index=row_numbers, dtype=object)
+    finally:
+        wb.close()
+
+def import_order_payloads(order_id: str, barcode_type: str, quantity: int, fileobj, file_format: str,
+                          column: Optional[str]) -> Dict:
+    """Stream-parse and validate an uploaded payload file into the order's payload store.
+
+    Valid rows are written out batch by batch; the payload file only replaces the
+    order's previous one when every row is valid and there is one row per barcode.
+    """
+    batches = iter_csv_payload_batches if file_format == "csv" else iter_xlsx_payload_batches
+    path = artifact_path(order_id, PAYLOAD_FILENAME)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Concurrent uploads for the same order each parse into their own temporary file
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    accepted = rejected = 0
+    errors = []
+    try:
+        with open(tmp_path, "wb") as output:
+            for batch in batches(fileobj, column):
+                values, batch_errors = validate_payload_batch(barcode_type, batch)
+                invalid = batch_errors.notna()
+                rejected += int(invalid.sum())
+                for row_number in batch_errors.index[invalid][:MAX_REPORTED_ROW_ERRORS - len(errors)]:
+                    errors.append({"row": int(row_number), "value": batch[row_number], "error": batch_errors[row_number]})
+                valid = values[~invalid]
+                accepted += len(valid)
+                output.write(b"".join(orjson.dumps(value) + b"\n" for value in valid))
+        
+        imported = not rejected and accepted == quantity
+        if imported:
+            tmp_path.replace(path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return {"imported": imported, "accepted": accepted, "rejected": rejected, "errors": errors}
+
+def load_order_payloads(order_id: str, start: int, end: int) -> List[str]:
+    """Read the uploaded payloads for rows [start, end) of an order"""
+    payloads = []
+    with open(artifact_path(order_id, PAYLOAD_FILENAME), "rb") as source:
+        for position, line in enumerate(source):
+            if position >= end:
+                break
+            if position >= start:
+                payloads.append(orjson.loads(line))
+    return payloads
+
+# Barcode Manifest and Index
+# Every order gets a Parquet manifest of its barcodes next to its archive, and its
+# barcode IDs are added to a global sorted index of fixed-width keys kept in .npy
+# files. Lookups memory-map the index and binary search it, so they never touch
+# MongoDB. Each completed order appends a small segment and merges it with the
+# newest segments of comparable size (size-tiered), so segment sizes shrink by at
+# least BARCODE_INDEX_MERGE_FACTOR from oldest to newest, their count stays
+# logarithmic and every barcode is rewritten O(log n) times over the index's life.
+BARCODE_INDEX_DIR = ARTIFACT_DIR / "barcode_index"
+BARCODE_INDEX_KEY_WIDTH = 32  # bytes; longer IDs are indexed by their hash
+BARCODE_INDEX_MERGE_FACTOR = 2
+BARCODE_INDEX_MAP_ATTEMPTS = 5
+
+def manifest_filename(order_id: str) -> str:
+    return f"barcodes_{order_id}.manifest.parquet"
+
+def barcode_index_key(barcode_id: str) -> bytes:
+    """Fixed-width index key for a barcode ID"""
+    key = barcode_id.encode()
+    if len(key) > BARCODE_INDEX_KEY_WIDTH:
+        key = hashlib.blake2b(key, digest_size=BARCODE_INDEX_KEY_WIDTH // 2).hexdigest().encode()
+    return key
+
+class BarcodeIndex:
+    """Memory-mapped barcode ID -> order ID index shared by all processes using ARTIFACT_DIR"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.state_path = directory / "index.json"
+        self.state_version = None
+        self.segments: List[tuple] = []  # newest first: (keys, slots, order_ids, order_id_set)
+
+    def _segment_paths(self, name: str) -> tuple:
+        return tuple(self.directory / f"{name}.{part}.npy" for part in ("keys", "slots", "order_ids"))
+
+    def _read_state(self) -> Dict:
+        if not self.state_path.is_file():
+            return {"segments": []}
+        return json.loads(self.state_path.read_text())
+
+    def _write_state(self, state: Dict):
+        tmp_path = self.state_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(state))
+        tmp_path.replace(self.state_path)
+
+    def _write_segment(self, keys: np.ndarray, slots: np.ndarray, order_ids: np.ndarray) -> str:
+        name = f"segment-{time.time_ns()}-{uuid.uuid4().hex[:6]}"
+        for path, array in zip(self._segment_paths(name), (keys, slots, order_ids)):
+            np.save(path, array)
+        return name
+
+    def _load_segment(self, name: str) -> tuple:
+        keys_path, slots_path, order_ids_path = self._segment_paths(name)
+        order_ids = np.load(order_ids_path)
+        return (
+            np.load(keys_path, mmap_mode="r"),
+            np.load(slots_path, mmap_mode="r"),
+            order_ids,
+            set(order_ids.tolist())
+        )
+
+    def _refresh(self):
+        """Remap the segments if another process changed the index"""
+        try:
+            version = self.state_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            version = None
+        if version == self.state_version:
+            return
+        for attempt in range(BARCODE_INDEX_MAP_ATTEMPTS):
+            try:
+                state = self._read_state()
+                self.segments = [self._load_segment(name) for name in reversed(state["segments"])]
+                break
+            except FileNotFoundError:
+                # A compaction retired these segments between reading the state and mapping
+                # them; a segment that stays missing means the index directory is damaged
+                if attempt == BARCODE_INDEX_MAP_ATTEMPTS - 1:
+                    raise
+        self.state_version = version
+
+    def lookup(self, barcode_id: str) -> Optional[str]:
+        """Return the ID of the order owning a barcode, or None"""
+        self._refresh()
+        key = np.array(barcode_index_key(barcode_id), dtype=f"S{BARCODE_INDEX_KEY_WIDTH}")
+        for i, (keys, slots, order_ids, _) in enumerate(self.segments):
+            position = int(np.searchsorted(keys, key))
+            if position < len(keys) and keys[position] == key:
+                order_id = order_ids[slots[position]]
+                # Orders regenerated later own only the IDs of their newest segment
+                if not any(order_id in newer[3] for newer in self.segments[:i]):
+                    return order_id.decode()
+        return None
+
+    def add_order(self, order_id: str, barcode_ids: List[str]):
+        """Index an order's barcodes, replacing any IDs indexed for it before"""
+        if not barcode_ids:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        keys = np.array([barcode_index_key(b) for b in barcode_ids], dtype=f"S{BARCODE_INDEX_KEY_WIDTH}")
+        keys.sort()
+        slots = np.zeros(len(keys), dtype=np.uint32)
+        order_ids = np.array([order_id.encode()])
+        with open(self.directory / "index.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = self._read_state()
+            segments = state["segments"]
+            segments.append(self._write_segment(keys, slots, order_ids))
+            merge_count = self._merge_count(segments)
+            retired = []
+            if merge_count > 1:
+                retired = segments[-merge_count:]
+                segments[-merge_count:] = [self._compact(retired)]
+            self._write_state(state)
+            for name in retired:
+                for path in self._segment_paths(name):
+                    path.unlink(missing_ok=True)
+
+    def _segment_size(self, name: str) -> int:
+        return np.load(self._segment_paths(name)[0], mmap_mode="r").shape[0]
+
+    def _merge_count(self, names: List[str]) -> int:
+        """How many of the newest segments to merge: every older neighbour that is at most
+        BARCODE_INDEX_MERGE_FACTOR times the size of the segments merged so far"""
+        count, merged_size = 1, self._segment_size(names[-1])
+        while count < len(names):
+            size = self._segment_size(names[-count - 1])
+            if size > BARCODE_INDEX_MERGE_FACTOR * merged_size:
+                break
+            count += 1
+            merged_size += size
+        return count
+
+    def _compact(self, names: List[str]) -> str:
+        """Merge adjacent segments into one, dropping IDs of orders regenerated among them"""
+        all_keys, all_order_ids = [], []
+        seen_orders = set()
+        for name in reversed(names):
+            keys, slots, order_ids, order_id_set = self._load_segment(name)
+            entry_orders = order_ids[slots]
+            live = ~np.isin(entry_orders, list(seen_orders)) if seen_orders else np.ones(len(keys), dtype=bool)
+            all_keys.append(np.asarray(keys)[live])
+            all_order_ids.append(entry_orders[live])
+            seen_orders |= order_id_set
+        keys = np.concatenate(all_keys)
+        order_ids, slots = np.unique(np.concatenate(all_order_ids), return_inverse=True)
+        order = np.argsort(keys, kind="stable")
+        return self._write_segment(keys[order], slots[order].astype(np.uint32), order_ids)
+
+    def rebuild(self, manifests: Dict[str, Path]):
+        """Replace the whole index with the barcodes of the given order manifests"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / "index.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            old_segments = self._read_state()["segments"]
+            order_ids = sorted(manifests)
+            keys, slots = [], []
+            for slot, order_id in enumerate(order_ids):
+                barcode_ids = pd.read_parquet(manifests[order_id], columns=["id"])["id"]
+                keys.append(np.array([barcode_index_key(b) for b in barcode_ids], dtype=f"S{BARCODE_INDEX_KEY_WIDTH}"))
+                slots.append(np.full(len(barcode_ids), slot, dtype=np.uint32))
+            segments = []
+            if keys:
+                keys = np.concatenate(keys)
+                slots = np.concatenate(slots)
+                order = np.argsort(keys, kind="stable")
+                segments.append(self._write_segment(keys[order], slots[order], np.array([o.encode() for o in order_ids])))
+            self._write_state({"segments": segments})
+            for old in old_segments:
+                for path in self._segment_paths(old):
+                    path.unlink(missing_ok=True)
+
+barcode_index = BarcodeIndex(BARCODE_INDEX_DIR)
+
+def store_order_manifest(order_id: str, barcode_list: List[Dict]) -> Path:
+    """Write the order's columnar manifest next to its archive and index its barcodes"""
+    path = artifact_path(order_id, manifest_filename(order_id))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    pd.DataFrame(barcode_list, columns=["id", "type", "data", "generated_at"]).to_parquet(tmp_path, index=False)
+    tmp_path.replace(path)
+    barcode_index.add_order(order_id, [bc["id"] for bc in barcode_list])
+    return path
+
+# Email Delivery
+SMTP_HOST = os.environ.get("SMTP_HOST")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
+SMTP_USERNAME = os.environ.get("SMTP_USERNAME")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD")
+SMTP_USE_TLS = os.environ.get("SMTP_USE_TLS", "true").lower() == "true"
+EMAIL_FROM = os.environ.get("EMAIL_FROM", SMTP_USERNAME or "no-reply@localhost")
+EMAIL_ATTACHMENT_LIMIT = int(os.environ.get("EMAIL_ATTACHMENT_LIMIT", str(10 * 1024 * 1024)))  # bytes
+EMAIL_POOL_SIZE = int(os.environ.get("EMAIL_POOL_SIZE", "2"))
+EMAIL_BATCH_SIZE = 50
+EMAIL_BATCH_WINDOW = 0.5  # seconds to wait while filling a batch
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BASE_DELAY = 2.0  # seconds, doubled on every attempt
+SMTP_IDLE_CHECK = 30.0  # seconds idle before a pooled connection is checked with NOOP
+EMAIL_DRAIN_TIMEOUT = float(os.environ.get("EMAIL_DRAIN_TIMEOUT", "30"))  # seconds to finish sending on shutdown
+EMAIL_LEASE_SECONDS = float(os.environ.get("EMAIL_LEASE_SECONDS", "600"))  # queued email is recovered after this
+EMAIL_RECOVERY_INTERVAL = 60.0
+PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL", "").rstrip("/")  # required with SMTP_HOST, for download links
+
+class SMTPConnectionPool:
+    """Thread-safe pool of persistent SMTP connections.
+
+    Connections are opened lazily, reused across batches and checked with NOOP
+    after sitting idle, so steady traffic pays the TCP/TLS/AUTH handshake once
+    per connection instead of once per message.
+    """
+
+    def __init__(self, host: str, port: int, username: Optional[str] = None,
+                 password: Optional[str] = None, use_tls: bool = True, size: int = 2):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.size = size
+        self.slots = queue.LifoQueue()
+        for _ in range(size):
+            self.slots.put((None, 0.0))
+
+    def connect(self) -> smtplib.SMTP:
+        connection = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.use_tls:
+            connection.starttls()
+        if self.username and self.password:
+            connection.login(self.username, self.password)
+        return connection
+
+    def acquire(self) -> smtplib.SMTP:
+        connection, last_used = self.slots.get()
+        if connection is not None and time.monotonic() - last_used > SMTP_IDLE_CHECK:
+            try:
+                if connection.noop()[0] != 250:
+                    raise smtplib.SMTPServerDisconnected("NOOP failed")
+            except (smtplib.SMTPException, OSError):
+                self._close(connection)
+                connection = None
+        if connection is None:
+            try:
+                connection = self.connect()
+            except Exception:
+                self.slots.put((None, 0.0))
+                raise
+        return connection
+
+    def release(self, connection: Optional[smtplib.SMTP]):
+        self.slots.put((connection, time.monotonic()))
+
+    def close_all(self):
+        for _ in range(self.size):
+            connection, _ = self.slots.get()
+            if connection is not None:
+                self._close(connection)
+        for _ in range(self.size):
+            self.slots.put((None, 0.0))
+
+    @staticmethod
+    def _close(connection: smtplib.SMTP):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+class EmailDeliveryWorker:
+    """Background email sender that batches queued jobs onto pooled SMTP connections.
+
+    Jobs are plain dicts. ``build_message`` turns a job into a MIME message inside
+    a worker thread and ``on_result(job, error)`` is awaited once the job is sent
+    or has exhausted its retries (``error`` is None on success).
+    """
+
+    def __init__(self, pool: SMTPConnectionPool, build_message, on_result,
+                 batch_size: int = EMAIL_BATCH_SIZE, batch_window: float = EMAIL_BATCH_WINDOW,
+                 max_attempts: int = EMAIL_MAX_ATTEMPTS, retry_base_delay: float = EMAIL_RETRY_BASE_DELAY):
+        self.pool = pool
+        self.build_message = build_message
+        self.on_result = on_result
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        self.retries: Dict[int, tuple] = {}  # id(job) -> (timer handle, job)
+        self.stopping = False
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.retries = {}
+        self.stopping = False
+        self.tasks = [asyncio.create_task(self._run()) for _ in range(self.pool.size)]
+
+    async def stop(self, timeout: float = EMAIL_DRAIN_TIMEOUT):
+        """Send every queued job, pending retries included, then close the pool.
+
+        Retries skip their backoff while draining. Jobs still unsent after the
+        timeout are dropped without a result.
+        """
+        self.stopping = True
+        for handle, job in self.retries.values():
+            handle.cancel()
+            self.queue.put_nowait(job)
+        self.retries = {}
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Email delivery stopped with {self.queue.qsize()} messages unsent")
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await asyncio.to_thread(self.pool.close_all)
+
+    def enqueue(self, job: Dict):
+        job.setdefault("attempt", 1)
+        self.queue.put_nowait(job)
+
+    async def _next_batch(self) -> List[Dict]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.batch_window
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                results = await asyncio.to_thread(self._send_batch, batch)
+            except Exception as e:
+                results = [(job, e) for job in batch]
+            for job, error in results:
+                await self._handle_result(job, error)
+            for _ in batch:
+                self.queue.task_done()
+
+    def _send_batch(self, batch: List[Dict]) -> List[tuple]:
+        """Send a batch over one pooled connection, reconnecting if the server drops it"""
+        results = []
+        connection = self.pool.acquire()
+        try:
+            for job in batch:
+                try:
+                    if connection is None:
+                        connection = self.pool.connect()
+                    connection.send_message(self.build_message(job))
+                    results.append((job, None))
+                except (smtplib.SMTPServerDisconnected, OSError) as e:
+                    if connection is not None:
+                        SMTPConnectionPool._close(connection)
+                    connection = None
+                    results.append((job, e))
+                except Exception as e:
+                    results.append((job, e))
+        finally:
+            self.pool.release(connection)
+        return results
+
+    async def _handle_result(self, job: Dict, error: Optional[Exception]):
+        permanent = isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+        if error is not None and not permanent and job["attempt"] < self.max_attempts:
+            delay = 0 if self.stopping else self.retry_base_delay * 2 ** (job["attempt"] - 1)
+            job["attempt"] += 1
+            logger.warning(f"Email delivery for {job.get('order_id')} failed, retrying in {delay}s: {error}")
+            if self.stopping:
+                self.queue.put_nowait(job)
+            else:
+                handle = asyncio.get_running_loop().call_later(delay, self._retry, job)
+                self.retries[id(job)] = (handle, job)
+            return
+        try:
+            await self.on_result(job, error)
+        except Exception as e:
+            logger.error(f"Email result callback failed for {job.get('order_id')}: {e}")
+
+    def _retry(self, job: Dict):
+        self.retries.pop(id(job), None)
+        self.queue.put_nowait(job)
+
+def build_order_email(job: Dict) -> MIMEMultipart:
+    """Build the order delivery email, attaching the archive or linking to it if too large"""
+    archive = Path(job["archive_path"])
+    message = MIMEMultipart()
+    message["From"] = EMAIL_FROM
+    message["To"] = job["to"]
+    message["Subject"] = f"Your barcodes are ready - Order {job['order_id']}"
+    
+    greeting = f"Dear {job.get('name') or 'Customer'},\n\n"
+    if archive.stat().st_size <= EMAIL_ATTACHMENT_LIMIT:
+        body = greeting + "Your barcode package is attached to this email.\n"
+        attachment = MIMEBase(*ARCHIVE_FORMATS[archive_format_of(archive)]["media_type"].split("/"))
+        attachment.set_payload(archive.read_bytes())
+        encoders.encode_base64(attachment)
+        attachment.add_header("Content-Disposition", f"attachment; filename={archive.name}")
+        message.attach(MIMEText(body, "plain"))
+        message.attach(attachment)
+    else:
+        link = f"{PUBLIC_BASE_URL}/api/order/{job['order_id']}/download"
+        body = greeting + f"Your barcode package is ready for download:\n{link}\n"
+        message.attach(MIMEText(body, "plain"))
+    return message
+
+def order_email_job(order_id: str, customer: Dict, archive: Path) -> Dict:
+    """Email delivery job for a completed order"""
+    return {"order_id": order_id, "to": customer["email"], "name": customer.get("name"), "archive_path": str(archive)}
+
+async def record_email_result(job: Dict, error: Optional[Exception]):
+    """Store the final email delivery outcome on the order"""
+    await db.barcode_orders.update_one(
+        {"id": job["order_id"]},
+        {"$set": {
+            "email_status": "failed" if error else "sent",
+            "email_lease_expires": None,
+            "updated_at": datetime.utcnow()
+        }}
+    )
+    if error:
+        logger.error(f"Email delivery for order {job['order_id']} failed: {error}")
+
+email_delivery = None
+if SMTP_HOST:
+    if not PUBLIC_BASE_URL:
+        raise RuntimeError(
+            "PUBLIC_BASE_URL must be set when SMTP_HOST is, so emails for archives over "
+            "EMAIL_ATTACHMENT_LIMIT can link to the download"
+        )
+    email_delivery = EmailDeliveryWorker(
+        SMTPConnectionPool(SMTP_HOST, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, SMTP_USE_TLS, EMAIL_POOL_SIZE),
+        build_order_email,
+        record_email_result
+    )
+email_recovery_task: Optional[asyncio.Task] = None
+
+async def requeue_stranded_emails() -> int:
+    """Queue emails still marked queued whose lease ran out, e.g. after a sender crashed.
+
+    Each order is claimed by renewing its lease, so only one process resends it.
+    """
+    requeued = 0
+    while True:
+        now = datetime.utcnow()
+        order_data = await db.barcode_orders.find_one_and_update(
+            {
+                "email_status": "queued",
+                "$or": [{"email_lease_expires": None}, {"email_lease_expires": {"$lt": now}}]
+            },
+            {"$set": {"email_lease_expires": now + timedelta(seconds=EMAIL_LEASE_SECONDS)}},
+            projection={"_id": 0, "id": 1, "customer_details": 1}
+        )
+        if not order_data:
+            return requeued
+        stored = find_order_archive(order_data["id"])
+        if stored is None:
+            await record_email_result({"order_id": order_data["id"]}, FileNotFoundError("order archive not found"))
+            continue
+        email_delivery.enqueue(order_email_job(order_data["id"], order_data["customer_details"], stored[1]))
+        requeued += 1
+
+async def recover_emails_periodically():
+    while True:
+        try:
+            requeued = await requeue_stranded_emails()
+            if requeued:
+                logger.info(f"Requeued {requeued} undelivered order emails")
+        except PyMongoError as e:
+            logger.error(f"Failed to requeue undelivered order emails: {e}")
+        await asyncio.sleep(EMAIL_RECOVERY_INTERVAL)
+
+def start_email_delivery():
+    """Start the email worker and the recovery of emails left queued by stopped processes"""
+    global email_recovery_task
+    if email_delivery is None:
+        return
+    email_delivery.start()
+    email_recovery_task = asyncio.create_task(recover_emails_periodically())
+
+async def stop_email_delivery():
+    """Stop recovering emails, then send what is still queued"""
+    global email_recovery_task
+    if email_delivery is None:
+        return
+    if email_recovery_task is not None:
+        email_recovery_task.cancel()
+        await asyncio.gather(email_recovery_task, return_exceptions=True)
+        email_recovery_task = None
+    await email_delivery.stop()
+
+async def complete_order(order: BarcodeOrder, archive: Path, barcode_list: List[Dict]):
+    """Store the order's manifest, mark it completed, queue its email and count it in rollups"""
+    await asyncio.to_thread(store_order_manifest, order.id, barcode_list)
+    
+    status_update = {"order_status": "completed", "progress": order.quantity, "updated_at": datetime.utcnow()}
+    send_email = bool(email_delivery is not None and email_delivery.tasks and order.customer_details.email)
+    if send_email:
+        status_update["email_status"] = "queued"
+        status_update["email_lease_expires"] = status_update["updated_at"] + timedelta(seconds=EMAIL_LEASE_SECONDS)
+    
+    # Update order status to completed
+    await db.barcode_orders.update_one({"id": order.id}, {"$set": status_update})
+    
+    # Queue only once "queued" is stored, so a fast delivery result cannot be overwritten by it
+    if send_email:
+        email_delivery.enqueue(order_email_job(order.id, order.customer_details.dict(), archive))
+    
+    # Count the order in the sales rollups only the first time it completes
+    first_completion = await db.barcode_orders.update_one(
+        {"id": order.id, "completed_at": None},
+        {"$set": {"completed_at": status_update["updated_at"]}}
+    )
+    if first_completion.modified_count:
+        await record_order_completed(order, status_update["updated_at"])
+
+# Distributed Chunk Processing
+# Large orders are split into order_chunks documents, each covering a range of the
+# order's barcodes. Any number of ChunkWorker processes (see chunk_worker.py) claim
+# chunks under a lease, render them to partial archives in ARTIFACT_DIR, which must
+# be shared between nodes, and the worker that completes the last chunk merges the
+# partial archives into the downloadable ZIP.
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", "1000"))
+CHUNK_LEASE_SECONDS = float(os.environ.get("CHUNK_LEASE_SECONDS", "60"))
+CHUNK_MAX_ATTEMPTS = 3
+CHUNK_IDLE_SLEEP = 1.0
+CHUNK_ERROR_BACKOFF = 1.0  # seconds, doubled for every consecutive failure
+CHUNK_MAX_ERROR_BACKOFF = 30.0
+CHUNK_MANIFEST = "manifest.json"
+
+async def create_order_chunks(order: BarcodeOrder, chunk_size: int = CHUNK_SIZE) -> int:
+    """Split an order into pending chunk documents and mark it as processing"""
+    now = datetime.utcnow()
+    chunks = [
+        {
+            "_id": f"{order.id}:{index}",
+            "order_id": order.id,
+            "index": index,
+            "start": start,
+            "end": min(start + chunk_size, order.quantity),
+            "status": "pending",  # pending, running, done, failed
+            "lease_owner": None,
+            "lease_expires": None,
+            "attempts": 0,
+            "artifact": None,
+            "created_at": now
+        }
+        for index, start in enumerate(range(0, order.quantity, chunk_size))
+    ]
+    await db.order_chunks.delete_many({"order_id": order.id})
+    await db.barcode_orders.update_one(
+        {"id": order.id},
+        {
+            "$set": {
+                "order_status": "processing",
+                "processing_mode": "distributed",
+                "progress": 0,
+                "finalize_owner": None,
+                "finalize_lease_expires": None,
+                "updated_at": now
+            }
+        }
+    )
+    await db.order_chunks.insert_many(chunks)
+    return len(chunks)
+
+def render_chunk_archive(barcode_type: str, count: int, path: Path, payloads: Optional[List[str]] = None) -> List[Dict]:
+    """Render a chunk's barcodes into a partial archive and return its manifest rows.
+
+    PNG data is already deflate-compressed, so images are stored uncompressed;
+    this lets the finalizer copy them into the final ZIP without recompressing.
+    """
+    barcode_list = generate_barcode_data(barcode_type, count, payloads)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as zip_file:
+        for bc in barcode_list:
+            img_data = render_barcode_png(bc['data'], bc['type'])
+            if img_data:
+                zip_file.writestr(f"barcodes/{bc['id']}.png", img_data)
+        zip_file.writestr(CHUNK_MANIFEST, json.dumps(barcode_list))
+    tmp_path.replace(path)
+    return barcode_list
+
+def merge_chunk_archives(order: BarcodeOrder, chunk_paths: List[Path], path: Path) -> List[Dict]:
+    """Build the final order archive from partial chunk archives and return all barcodes"""
+    barcode_list = []
+    for chunk_path in chunk_paths:
+        with zipfile.ZipFile(chunk_path) as chunk_zip:
+            barcode_list.extend(json.loads(chunk_zip.read(CHUNK_MANIFEST)))
+    
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("barcode_data.xlsx", build_barcode_workbook(barcode_list))
+        
+        # Stored entries are streamed across as-is, no codec work involved
+        for chunk_path in chunk_paths:
+            with zipfile.ZipFile(chunk_path) as chunk_zip:
+                for info in chunk_zip.infolist():
+                    if info.filename == CHUNK_MANIFEST:
+                        continue
+                    entry = zipfile.ZipInfo(info.filename, info.date_time)
+                    entry.compress_type = info.compress_type
+                    entry.file_size = info.file_size
+                    with chunk_zip.open(info) as source, zip_file.open(entry, 'w') as target:
+                        shutil.copyfileobj(source, target, 1024 * 1024)
+        
+        zip_file.writestr("invoice.json", build_invoice_json(order))
+    tmp_path.replace(path)
+    return barcode_list
+
+class ChunkWorker:
+    """Claims order chunks under a lease, renders them and finalizes completed orders"""
+
+    def __init__(self, worker_id: Optional[str] = None, lease_seconds: float = CHUNK_LEASE_SECONDS):
+        self.worker_id = worker_id or f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+
+    def lease_expiry(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+
+    async def run(self, exit_when_idle: bool = False):
+        failures = 0
+        while True:
+            try:
+                chunk = await self.claim_chunk()
+                if chunk is not None:
+                    await self.process_chunk(chunk)
+                    failures = 0
+                    continue
+                finalized = await self.finalize_orphaned_orders()
+            except Exception as e:
+                # Failovers and other errors must not take the worker down; expired
+                # leases hand any chunk or order it was holding to another worker
+                failures += 1
+                delay = min(CHUNK_ERROR_BACKOFF * 2 ** (failures - 1), CHUNK_MAX_ERROR_BACKOFF)
+                if isinstance(e, PyMongoError):
+                    logger.warning(f"Chunk worker {self.worker_id} database error, retrying in {delay}s: {e}")
+                else:
+                    logger.exception(f"Chunk worker {self.worker_id} failed, retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+                continue
+            failures = 0
+            if not finalized:
+                if exit_when_idle:
+                    return
+                await asyncio.sleep(CHUNK_IDLE_SLEEP)
+
+    async def claim_chunk(self) -> Optional[Dict]:
+        """Take a pending chunk, or one whose previous worker let its lease expire"""
+        now = datetime.utcnow()
+        return await db.order_chunks.find_one_and_update(
+            {"$or": [
+                {"status": "pending"},
+                {"status": "running", "lease_expires": {"$lt": now}}
+            ]},
+            {
+                "$set": {"status": "running", "lease_owner": self.worker_id, "lease_expires": self.lease_expiry()},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", 1), ("index", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def process_chunk(self, chunk: Dict):
+        order_id = chunk["order_id"]
+        owned = {"_id": chunk["_id"], "lease_owner": self.worker_id, "status": "running"}
+        if chunk["attempts"] > CHUNK_MAX_ATTEMPTS:
+            await db.order_chunks.update_one(owned, {"$set": {"status": "failed", "lease_expires": None}})
+            await db.barcode_orders.update_one(
+                {"id": order_id},
+                {"$set": {"order_status": "failed", "updated_at": datetime.utcnow()}}
+            )
+            return
+        
+        order_data = await db.barcode_orders.find_one({"id": order_id}, ORDER_PROJECTION)
+        if not order_data or order_data.get("order_status") != "processing":
+            await db.order_chunks.update_one(owned, {"$set": {"status": "failed", "lease_expires": None}})
+            return
+        
+        count = chunk["end"] - chunk["start"]
+        filename = f"chunks/chunk_{chunk['index']:05d}_{uuid.uuid4().hex[:8]}.zip"
+        try:
+            payloads = None
+            if order_data.get("payload_source") == "upload":
+                payloads = await asyncio.to_thread(load_order_payloads, order_id, chunk["start"], chunk["end"])
+            render = asyncio.create_task(asyncio.to_thread(
+                render_chunk_archive, order_data["barcode_type"], count, artifact_path(order_id, filename), payloads
+            ))
+            # Keep the lease alive while the chunk renders
+            while not render.done():
+                await asyncio.wait({render}, timeout=self.lease_seconds / 3)
+                if not render.done():
+                    await db.order_chunks.update_one(owned, {"$set": {"lease_expires": self.lease_expiry()}})
+            render.result()
+        except Exception as e:
+            logger.error(f"Chunk {chunk['_id']} failed on {self.worker_id}: {e}")
+            await db.order_chunks.update_one(
+                owned, {"$set": {"status": "pending", "lease_owner": None, "lease_expires": None}}
+            )
+            return
+        
+        done = await db.order_chunks.update_one(
+            owned, {"$set": {"status": "done", "artifact": filename, "lease_expires": None}}
+        )
+        if not done.modified_count:
+            # Lease was lost to another worker, whose result wins
+            artifact_path(order_id, filename).unlink(missing_ok=True)
+            return
+        
+        await db.barcode_orders.update_one(
+            {"id": order_id},
+            {"$inc": {"progress": count}, "$set": {"updated_at": datetime.utcnow()}}
+        )
+        if not await db.order_chunks.count_documents({"order_id": order_id, "status": {"$ne": "done"}}):
+            await self.finalize_order(order_id)
+
+    async def finalize_orphaned_orders(self) -> bool:
+        """Finalize orders whose chunks are all done but whose finalizer never finished"""
+        finalized = False
+        cursor = db.barcode_orders.find(
+            {
+                "processing_mode": "distributed",
+                "order_status": "processing",
+                "$expr": {"$gte": ["$progress", "$quantity"]},
+                "$or": [{"finalize_lease_expires": None}, {"finalize_lease_expires": {"$lt": datetime.utcnow()}}]
+            },
+            {"_id": 0, "id": 1}
+        )
+        async for order in cursor:
+            finalized = await self.finalize_order(order["id"]) or finalized
+        return finalized
+
+    async def finalize_order(self, order_id: str) -> bool:
+        """Merge an order's partial archives into its final ZIP if no other worker is doing so"""
+        now = datetime.utcnow()
+        order_data = await db.barcode_orders.find_one_and_update(
+            {
+                "id": order_id,
+                "order_status": "processing",
+                "$or": [{"finalize_lease_expires": None}, {"finalize_lease_expires": {"$lt": now}}]
+            },
+            {"$set": {"finalize_owner": self.worker_id, "finalize_lease_expires": self.lease_expiry()}},
+            projection=ORDER_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+        if not order_data:
+            return False
+        
+        chunks = await db.order_chunks.find({"order_id": order_id}).sort("index", 1).to_list(None)
+        if not chunks or any(chunk["status"] != "done" for chunk in chunks):
+            await db.barcode_orders.update_one(
+                {"id": order_id, "finalize_owner": self.worker_id},
+                {"$set": {"finalize_owner": None, "finalize_lease_expires": None}}
+            )
+            return False
+        
+        order = BarcodeOrder(**order_data)
+        remove_order_archives(order_id)
+        archive = artifact_path(order_id, archive_filename(order_id, "zip-deflate"))
+        chunk_paths = [artifact_path(order_id, chunk["artifact"]) for chunk in chunks]
+        merge = asyncio.create_task(asyncio.to_thread(merge_chunk_archives, order, chunk_paths, archive))
+        try:
+            while not merge.done():
+                await asyncio.wait({merge}, timeout=self.lease_seconds / 3)
+                if not merge.done():
+                    await db.barcode_orders.update_one(
+                        {"id": order_id, "finalize_owner": self.worker_id},
+                        {"$set": {"finalize_lease_expires": self.lease_expiry()}}
+                    )
+            barcode_list = merge.result()
+        except Exception as e:
+            logger.error(f"Finalizing order {order_id} failed on {self.worker_id}: {e}")
+            await db.barcode_orders.update_one(
+                {"id": order_id},
+                {"$set": {"order_status": "failed", "updated_at": datetime.utcnow()}}
+            )
+            return False
+        
+        await complete_order(order, archive, barcode_list)
+        await db.order_chunks.delete_many({"order_id": order_id})
+        shutil.rmtree(artifact_path(order_id, "chunks"), ignore_errors=True)
+        return True
+
+async def ensure_chunk_indexes():
+    await db.order_chunks.create_index([("status", 1), ("created_at", 1), ("index", 1)])
+    await db.order_chunks.create_index([("order_id", 1), ("index", 1)])
+
 # API Routes
 @api_router.get("/")
 async def root():
@@ -231,16 +1784,18 @@ async def create_order(order_data: BarcodeOrderCreate):
             final_amount=tax_details["total_amount"]
         )
         
-        # Save to database
-        await db.barcode_orders.insert_one(order.dict())
+        # Save to database (insert_one adds _id to the document it is given, so pass a copy)
+        order_doc = order.dict()
+        await db.barcode_orders.insert_one(dict(order_doc))
+        await record_order_created(order)
         
-        return {
+        return json_response({
             "order_id": order.id,
-            "order": order.dict(),
+            "order": order_doc,
             "tax_details": tax_details,
             "currency": "INR",
             "message": "Order created successfully"
-        }
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create order: {str(e)}")
@@ -248,98 +1803,161 @@ async def create_order(order_data: BarcodeOrderCreate):
 @api_router.get("/order/{order_id}")
 async def get_order(order_id: str):
     """Get order details by ID"""
-    order = await db.barcode_orders.find_one({"id": order_id})
+    order = await db.barcode_orders.find_one({"id": order_id}, ORDER_PROJECTION)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    # Convert MongoDB ObjectId to string to make it JSON serializable
-    if "_id" in order:
-        order["_id"] = str(order["_id"])
+    return json_response(order)
+
+@api_router.get("/order/{order_id}/events")
+async def order_events(order_id: str, request: Request):
+    """Stream order status and progress changes as Server-Sent Events"""
+    queue = order_status_broadcaster.subscribe(order_id)
+    order = await db.barcode_orders.find_one({"id": order_id}, ORDER_EVENT_FIELDS)
+    if not order:
+        order_status_broadcaster.unsubscribe(order_id, queue)
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    async def event_stream():
+        try:
+            event = order
+            last_sent = None
+            while True:
+                if event is not None:
+                    key = (event.get("order_status"), event.get("progress"))
+                    changed = key != last_sent
+                    # The first snapshot may be the result of an earlier run that is about
+                    # to be retried, so only a later change to a final status ends the stream
+                    if changed and last_sent is not None and event.get("order_status") in FINAL_ORDER_STATUSES:
+                        yield format_sse("status", event)
+                        break
+                    if changed:
+                        last_sent = key
+                        yield format_sse("status", event)
+                if await request.is_disconnected():
+                    break
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    event = None
+                    yield ": keep-alive\n\n"
+        finally:
+            order_status_broadcaster.unsubscribe(order_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.post("/order/{order_id}/payloads")
+async def upload_order_payloads(order_id: str, file: UploadFile = File(...), column: Optional[str] = None):
+    """Upload a CSV or XLSX file with one payload per row to encode instead of generated IDs.
+
+    The file needs a header row; the payload column is picked by the column
+    parameter, a data/payload/value/sku/url header, or else the first column.
+    The upload is only accepted when every row is valid and the row count
+    matches the ordered quantity.
+    """
+    order_data = await db.barcode_orders.find_one({"id": order_id}, ORDER_PROJECTION)
+    if not order_data:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if order_data.get("order_status") == "processing":
+        raise HTTPException(status_code=409, detail="Order is already being processed")
+    
+    filename = (file.filename or "").lower()
+    if filename.endswith(".csv") or file.content_type == "text/csv":
+        file_format = "csv"
+    elif filename.endswith(".xlsx"):
+        file_format = "xlsx"
+    else:
+        raise HTTPException(status_code=400, detail="Upload a .csv or .xlsx file")
+    
+    try:
+        report = await asyncio.to_thread(
+            import_order_payloads, order_id, order_data["barcode_type"], order_data["quantity"],
+            file.file, file_format, column
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not read the uploaded file: {str(e)}")
+    
+    if not report["imported"]:
+        if report["rejected"]:
+            message = "Some rows are invalid"
+        else:
+            message = f"The order is for {order_data['quantity']} barcodes but the file has {report['accepted']} rows"
+        return json_response(dict(report, message=message), status_code=422)
+    
+    await db.barcode_orders.update_one(
+        {"id": order_id},
+        {"$set": {"payload_source": "upload", "updated_at": datetime.utcnow()}}
+    )
     
-    return order
+    return json_response(dict(report, message="Payloads imported successfully"))
 
 @api_router.post("/process-order/{order_id}")
-async def process_order(order_id: str):
-    """Process order - generate barcodes and create zip file"""
+async def process_order(order_id: str, request: Request, archive_format: Optional[str] = Query(None, alias="format")):
+    """Process order - generate barcodes and create the archive (zip-deflate, zip-stored or tar.zst)"""
+    archive_format = negotiate_archive_format(archive_format, request.headers.get("accept"), DEFAULT_ARCHIVE_FORMAT)
     try:
         # Get order from database
-        order_data = await db.barcode_orders.find_one({"id": order_id})
+        order_data = await db.barcode_orders.find_one({"id": order_id}, ORDER_PROJECTION)
         if not order_data:
             raise HTTPException(status_code=404, detail="Order not found")
         
-        # Convert MongoDB ObjectId to string
-        if "_id" in order_data:
-            order_data["_id"] = str(order_data["_id"])
-        
         order = BarcodeOrder(**order_data)
         
         # Update order status to processing
         await db.barcode_orders.update_one(
             {"id": order_id},
-            {"$set": {"order_status": "processing", "updated_at": datetime.utcnow()}}
+            {"$set": {"order_status": "processing", "progress": 0, "updated_at": datetime.utcnow()}}
         )
         
         # Generate barcode data
-        barcode_list = generate_barcode_data(order.barcode_type, order.quantity)
+        payloads = None
+        if order.payload_source == "upload":
+            payloads = await asyncio.to_thread(load_order_payloads, order_id, 0, order.quantity)
+        barcode_list = generate_barcode_data(order.barcode_type, order.quantity, payloads)
         
-        # Create in-memory zip file
-        zip_buffer = io.BytesIO()
+        # Create in-memory archive
+        archive_buffer = io.BytesIO()
         
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            # Create Excel file with barcode data
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Barcode_Data"
-            
-            # Headers
-            ws['A1'] = "Barcode ID"
-            ws['B1'] = "Type"
-            ws['C1'] = "Data"
-            ws['D1'] = "Generated At"
-            
-            # Add barcode data
-            for idx, bc in enumerate(barcode_list, 2):
-                ws[f'A{idx}'] = bc['id']
-                ws[f'B{idx}'] = bc['type']
-                ws[f'C{idx}'] = bc['data']
-                ws[f'D{idx}'] = bc['generated_at']
-            
-            # Save Excel to buffer
-            excel_buffer = io.BytesIO()
-            wb.save(excel_buffer)
-            excel_buffer.seek(0)
-            
-            # Add Excel file to zip
-            zip_file.writestr("barcode_data.xlsx", excel_buffer.getvalue())
+        with open_archive_writer(archive_format, archive_buffer) as archive_writer:
+            # Add Excel file with barcode data
+            archive_writer.add("barcode_data.xlsx", build_barcode_workbook(barcode_list))
             
             # Generate and add barcode images
-            for idx, bc in enumerate(barcode_list):
-                img_base64 = create_barcode_image(bc['data'], bc['type'])
-                if img_base64:
-                    img_data = base64.b64decode(img_base64)
-                    zip_file.writestr(f"barcodes/{bc['id']}.png", img_data)
+            progress_step = max(1, int(order.quantity * PROGRESS_UPDATE_STEP))
+            idx = 0
+            async for bc, img_data in render_barcodes(barcode_list):
+                idx += 1
+                if img_data:
+                    archive_writer.add(f"barcodes/{bc['id']}.png", img_data)
+                
+                # Report progress for order event subscribers
+                if idx % progress_step == 0 and idx < order.quantity:
+                    await db.barcode_orders.update_one(
+                        {"id": order_id},
+                        {"$set": {"progress": idx, "updated_at": datetime.utcnow()}}
+                    )
             
-            # Create invoice data with INR
-            state = order.customer_details.state or "other"
-            tax_details = calculate_tax_and_total(order.total_amount, state)
-            invoice_data = create_invoice_data(order, tax_details)
-            
-            # Add invoice JSON
-            zip_file.writestr("invoice.json", json.dumps(invoice_data, indent=2))
+            # Add invoice JSON with INR
+            archive_writer.add("invoice.json", build_invoice_json(order))
         
-        # Update order status to completed
-        await db.barcode_orders.update_one(
-            {"id": order_id},
-            {"$set": {"order_status": "completed", "updated_at": datetime.utcnow()}}
-        )
+        # Keep the archive for later downloads and email delivery
+        remove_order_archives(order_id)
+        archive = save_artifact(order_id, archive_filename(order_id, archive_format), archive_buffer.getvalue())
+        await complete_order(order, archive, barcode_list)
         
-        # Return zip file
-        zip_buffer.seek(0)
+        # Return archive file
+        archive_buffer.seek(0)
         
         return StreamingResponse(
-            io.BytesIO(zip_buffer.read()),
-            media_type="application/zip",
-            headers={"Content-Disposition": f"attachment; filename=barcodes_{order_id}.zip"}
+            archive_buffer,
+            media_type=ARCHIVE_FORMATS[archive_format]["media_type"],
+            headers={"Content-Disposition": f"attachment; filename={archive_download_name(order_id, archive_format)}"}
         )
         
     except Exception as e:
@@ -350,17 +1968,128 @@ async def process_order(order_id: str):
         )
         raise HTTPException(status_code=500, detail=f"Failed to process order: {str(e)}")
 
+@api_router.post("/process-order/{order_id}/distributed", status_code=202)
+async def process_order_distributed(order_id: str, chunk_size: int = CHUNK_SIZE):
+    """Queue a large order for chunked processing by chunk_worker.py processes.
+
+    Follow progress through /api/order/{order_id}/events and fetch the result
+    from /api/order/{order_id}/download once the order is completed.
+    """
+    if chunk_size <= 0:
+        raise HTTPException(status_code=400, detail="Chunk size must be greater than 0")
+    
+    order_data = await db.barcode_orders.find_one({"id": order_id}, ORDER_PROJECTION)
+    if not order_data:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if order_data.get("order_status") == "processing":
+        raise HTTPException(status_code=409, detail="Order is already being processed")
+    
+    order = BarcodeOrder(**order_data)
+    chunks = await create_order_chunks(order, chunk_size)
+    
+    return json_response({
+        "order_id": order_id,
+        "chunks": chunks,
+        "chunk_size": chunk_size,
+        "message": "Order queued for distributed processing"
+    }, status_code=202)
+
+@api_router.get("/order/{order_id}/download")
+async def download_order(order_id: str, request: Request, archive_format: Optional[str] = Query(None, alias="format")):
+    """Download a previously generated order archive, repackaged if another format is requested"""
+    stored = find_order_archive(order_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Order archive not found")
+    
+    stored_format, stored_path = stored
+    archive_format = negotiate_archive_format(archive_format, request.headers.get("accept"), stored_format)
+    path = artifact_path(order_id, archive_filename(order_id, archive_format))
+    if not path.is_file():
+        await asyncio.to_thread(convert_archive, stored_path, stored_format, path, archive_format)
+    
+    return FileResponse(
+        path,
+        media_type=ARCHIVE_FORMATS[archive_format]["media_type"],
+        filename=archive_download_name(order_id, archive_format)
+    )
+
+@api_router.get("/order/{order_id}/manifest")
+async def download_order_manifest(order_id: str):
+    """Download the Parquet manifest listing every barcode of an order"""
+    path = artifact_path(order_id, manifest_filename(order_id))
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Order manifest not found")
+    
+    return FileResponse(path, media_type="application/vnd.apache.parquet", filename=path.name)
+
+@api_router.get("/lookup/{barcode_id}")
+async def lookup_barcode(barcode_id: str):
+    """Find the order that owns a barcode using the memory-mapped barcode index"""
+    try:
+        order_id = barcode_index.lookup(barcode_id)
+    except (OSError, ValueError) as e:
+        logger.error(f"Barcode index unavailable: {e}")
+        raise HTTPException(status_code=503, detail="Barcode index is unavailable, try again later")
+    if order_id is None:
+        raise HTTPException(status_code=404, detail="Barcode not found")
+    
+    return json_response({"barcode_id": barcode_id, "order_id": order_id})
+
+@api_router.get("/analytics")
+async def get_analytics(start: Optional[str] = None, end: Optional[str] = None,
+                        group_by: str = "day,barcode_type", barcode_type: Optional[str] = None,
+                        state: Optional[str] = None):
+    """Sales analytics from the precomputed day/type/state rollups (dates as YYYY-MM-DD)"""
+    dimensions = [d.strip() for d in group_by.split(",") if d.strip()]
+    invalid = [d for d in dimensions if d not in ROLLUP_DIMENSIONS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid group_by: {', '.join(invalid)}")
+    
+    for value in (start, end):
+        if value is not None:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Dates must use the YYYY-MM-DD format")
+    
+    query: Dict[str, Any] = {}
+    if start or end:
+        query["day"] = {}
+        if start:
+            query["day"]["$gte"] = start
+        if end:
+            query["day"]["$lte"] = end
+    if barcode_type:
+        query["barcode_type"] = barcode_type
+    if state:
+        query["state"] = rollup_state(state)
+    
+    groups: Dict[tuple, Dict] = {}
+    totals = {counter: 0 for counter in ROLLUP_COUNTERS}
+    async for bucket in db.sales_rollups.find(query, {"_id": 0}):
+        key = tuple(bucket[d] for d in dimensions)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = dict({d: bucket[d] for d in dimensions}, **{c: 0 for c in ROLLUP_COUNTERS})
+        for counter in ROLLUP_COUNTERS:
+            group[counter] += bucket.get(counter, 0)
+            totals[counter] += bucket.get(counter, 0)
+    
+    return json_response({
+        "group_by": dimensions,
+        "start": start,
+        "end": end,
+        "currency": "INR",
+        "totals": totals,
+        "groups": [groups[key] for key in sorted(groups)]
+    })
+
 @api_router.get("/orders")
 async def list_orders(limit: int = 50):
     """List all orders with pagination"""
-    orders = await db.barcode_orders.find().limit(limit).to_list(limit)
+    orders = await db.barcode_orders.find({}, ORDER_PROJECTION).limit(limit).to_list(limit)
     
-    # Convert MongoDB ObjectId to string for JSON serialization
-    for order in orders:
-        if "_id" in order:
-            order["_id"] = str(order["_id"])
-    
-    return {"orders": orders}
+    return json_response({"orders": orders})
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -380,6 +2109,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_background_services():
+    try:
+        await db.sales_rollups.create_index([("day", 1), ("barcode_type", 1), ("state", 1)])
+        await ensure_chunk_indexes()
+    except PyMongoError as e:
+        logger.error(f"Failed to create indexes: {e}")
+    start_email_delivery()
+    
+    # Start the render workers now so the first order does not pay their start-up cost
+    pool = get_render_pool()
+    if pool is not None:
+        for _ in range(RENDER_WORKERS):
+            pool.submit(render_barcode_batch, [])
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await order_status_broadcaster.stop()
+    shutdown_render_pool()
+    await stop_email_delivery()
     client.close()
\ No newline at end of file
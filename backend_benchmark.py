@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+import tempfile
+from email.mime.text import MIMEText
+
+# The server module reads its Mongo settings at import time; the benchmarks
+# below never touch the database, so any placeholder values will do.
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "barcode_benchmark")
+os.environ.setdefault("ARTIFACT_DIR", tempfile.mkdtemp(prefix="barcode_bench_"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import server
+
+def report(name, count, elapsed, unit="msg"):
+    """Print a benchmark result line"""
+    rate = count / elapsed if elapsed else float("inf")
+    print(f"[BENCH] {name}: {count} {unit} in {elapsed:.3f}s ({rate:.1f} {unit}/s)")
+
+def bench_email_delivery(messages=500):
+    """Compare one-connection-per-message SMTP sends with the pooled, batched worker"""
+    print("\n=== Benchmarking Email Delivery ===")
+    from aiosmtpd.controller import Controller
+    logging.getLogger("mail.log").setLevel(logging.WARNING)
+
+    class CountingHandler:
+        def __init__(self):
+            self.received = 0
+
+        async def handle_DATA(self, smtp_server, session, envelope):
+            self.received += 1
+            return "250 OK"
+
+    handler = CountingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=8025)
+    controller.start()
+
+    def build_message(job):
+        message = MIMEText(f"Benchmark message {job['order_id']}")
+        message["From"] = "bench@localhost"
+        message["To"] = job["to"]
+        message["Subject"] = f"Benchmark {job['order_id']}"
+        return message
+
+    try:
+        pool = server.SMTPConnectionPool("127.0.0.1", 8025, use_tls=False, size=server.EMAIL_POOL_SIZE)
+
+        # Baseline: connect, send and quit for every message
+        start = time.perf_counter()
+        for i in range(messages):
+            connection = pool.connect()
+            connection.send_message(build_message({"order_id": i, "to": "customer@example.com"}))
+            connection.quit()
+        report("SMTP connection per message", messages, time.perf_counter() - start)
+
+        # Pooled connections with batched background delivery
+        async def run_worker():
+            done = asyncio.Event()
+            sent = []
+
+            async def on_result(job, error):
+                sent.append(error)
+                if len(sent) == messages:
+                    done.set()
+
+            worker = server.EmailDeliveryWorker(pool, build_message, on_result, batch_window=0.01)
+            worker.start()
+            start = time.perf_counter()
+            for i in range(messages):
+                worker.enqueue({"order_id": i, "to": "customer@example.com"})
+            await done.wait()
+            elapsed = time.perf_counter() - start
+            await worker.stop()
+            return elapsed, sum(1 for error in sent if error is not None)
+
+        elapsed, failures = asyncio.run(run_worker())
+        report("Pooled batched worker", messages, elapsed)
+        if failures:
+            print(f"[BENCH] Pooled batched worker: {failures} messages failed")
+    finally:
+        controller.stop()
+
+    print(f"[BENCH] SMTP stand-in received {handler.received} messages")
+
+def sample_order_document():
+    """Build an order document shaped like a stored barcode_orders entry"""
+    customer = server.CustomerDetails(
+        name="Rajesh", surname="Patel", organization="ABC Technologies", country="India",
+        address="123 Main Street, Ahmedabad", phone="9876543210",
+        email="rajesh.patel@example.com", gst_number="24ABCDE1234F1Z5", state="Gujarat"
+    )
+    order = server.BarcodeOrder(
+        customer_details=customer, barcode_type="qr_code", quantity=100,
+        total_amount=15000.0, tax_amount=2700.0, final_amount=17700.0
+    )
+    return order.dict()
+
+def bench_order_serialization(orders=500, rounds=50):
+    """Compare the old jsonable_encoder response path with the orjson path for order endpoints"""
+    print("\n=== Benchmarking Order Serialization ===")
+    from bson import ObjectId
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    documents = [sample_order_document() for _ in range(orders)]
+
+    def before(docs):
+        # Documents come back from Mongo with an ObjectId that the handler patched by hand
+        docs = [dict(doc, _id=ObjectId()) for doc in docs]
+        for doc in docs:
+            doc["_id"] = str(doc["_id"])
+        return JSONResponse(jsonable_encoder({"orders": docs})).body
+
+    def after(docs):
+        # _id is excluded by projection and the documents are encoded directly
+        docs = [dict(doc) for doc in docs]
+        return server.json_response({"orders": docs}).body
+
+    for name, render in (("before", before), ("after", after)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            render(documents)
+        report(f"/api/orders ({orders} orders) {name}", rounds, time.perf_counter() - start, "responses")
+
+        start = time.perf_counter()
+        for _ in range(rounds * 20):
+            render(documents[:1])
+        report(f"/api/order/{{id}} {name}", rounds * 20, time.perf_counter() - start, "responses")
+
+def bench_archive_formats(quantity=5000):
+    """Compare CPU time, wall time and size of each archive format for the same order contents.
+
+    The default order is about 36 MiB uncompressed. zstd hands each worker thread
+    jobs of several MiB at ZSTD_LEVEL 3, so small inputs would never compress in parallel.
+    """
+    print("\n=== Benchmarking Archive Formats ===")
+    import base64
+    import io
+
+    barcode_list = server.generate_barcode_data("code128", quantity)
+    entries = [("barcode_data.xlsx", server.build_barcode_workbook(barcode_list))]
+    for bc in barcode_list:
+        entries.append((f"barcodes/{bc['id']}.png", base64.b64decode(server.create_barcode_image(bc["data"], bc["type"]))))
+    raw_size = sum(len(data) for _, data in entries)
+    print(f"[BENCH] {len(entries)} entries, {raw_size / 1024 / 1024:.1f} MiB uncompressed, "
+          f"zstd threads {server.ZSTD_THREADS} on {os.cpu_count()} CPUs")
+
+    for archive_format in server.ARCHIVE_FORMATS:
+        buffer = io.BytesIO()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        with server.open_archive_writer(archive_format, buffer) as writer:
+            for name, data in entries:
+                writer.add(name, data)
+        cpu = time.process_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+        size = len(buffer.getvalue())
+        print(f"[BENCH] {archive_format}: wall {wall:.3f}s, cpu {cpu:.3f}s, "
+              f"size {size / 1024:.0f} KiB ({size / raw_size:.1%})")
+
+def bench_barcode_lookup(orders=10000, per_order=100, lookups=20000):
+    """Measure barcode -> order lookups, hits and misses, against the memory-mapped barcode index"""
+    print("\n=== Benchmarking Barcode Lookup ===")
+    import random
+    from pathlib import Path
+
+    index = server.BarcodeIndex(Path(tempfile.mkdtemp(prefix="barcode_index_")))
+    barcode_ids = []
+    start = time.perf_counter()
+    for _ in range(orders):
+        batch = [b["id"] for b in server.generate_barcode_data("code128", per_order)]
+        index.add_order(str(server.uuid.uuid4()), batch)
+        barcode_ids.extend(batch)
+    report("Index build (incremental, with compaction)", orders, time.perf_counter() - start, "orders")
+
+    samples = {
+        "Hits": random.choices(barcode_ids, k=lookups),
+        "Misses": [b["id"] for b in server.generate_barcode_data("code128", lookups)],
+    }
+    index.lookup(barcode_ids[0])
+    for name, sample in samples.items():
+        start = time.perf_counter()
+        for barcode_id in sample:
+            index.lookup(barcode_id)
+        elapsed = time.perf_counter() - start
+        report(f"{name} over {len(barcode_ids)} barcodes of {orders} orders", lookups, elapsed, "lookups")
+        print(f"[BENCH] {elapsed / lookups * 1e6:.1f} us per lookup")
+
+def legacy_render_batch(items):
+    """Render images the way create_barcode_image did before the warm renderer: a new writer each time"""
+    import io
+    import barcode
+    from barcode.writer import ImageWriter
+
+    images = []
+    for barcode_data, barcode_type in items:
+        buffer = io.BytesIO()
+        barcode.get_barcode_class(barcode_type)(barcode_data, writer=ImageWriter()).write(buffer)
+        images.append(buffer.getvalue())
+    return images
+
+def bench_render_workers(images=512, workers=2):
+    """Compare first-image latency and steady-state throughput of cold and warm render workers"""
+    print("\n=== Benchmarking Render Workers ===")
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    items = [(bc["data"], bc["type"]) for bc in server.generate_barcode_data("code128", images)]
+    batches = [items[i:i + server.RENDER_BATCH_SIZE] for i in range(0, len(items), server.RENDER_BATCH_SIZE)]
+    context = multiprocessing.get_context("spawn")
+
+    # Single process: stock writer per image versus the cached renderer
+    start = time.perf_counter()
+    legacy_render_batch(items[:200])
+    report("In-process stock ImageWriter", 200, time.perf_counter() - start, "images")
+    server.get_renderer().warm_up()
+    start = time.perf_counter()
+    server.render_barcode_batch(items[:200])
+    report("In-process warm renderer", 200, time.perf_counter() - start, "images")
+
+    # First image: a freshly started cold worker versus an already warmed pool
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        pool.submit(legacy_render_batch, items[:1]).result()
+        print(f"[BENCH] Cold worker first image: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=server.init_render_worker) as pool:
+        pool.submit(server.render_barcode_batch, []).result()
+        start = time.perf_counter()
+        pool.submit(server.render_barcode_batch, items[:1]).result()
+        print(f"[BENCH] Warm worker first image: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # Steady state: workers started per batch versus a warm, recycled pool
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, max_tasks_per_child=1) as pool:
+        list(pool.map(legacy_render_batch, batches))
+    report(f"Cold workers ({workers}, new process per batch)", images, time.perf_counter() - start, "images")
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=server.init_render_worker,
+                             max_tasks_per_child=server.RENDER_WORKER_MAX_TASKS) as pool:
+        list(pool.map(server.render_barcode_batch, [[]] * workers))
+        start = time.perf_counter()
+        list(pool.map(server.render_barcode_batch, batches))
+        report(f"Warm workers ({workers})", images, time.perf_counter() - start, "images")
+
+if __name__ == "__main__":
+    bench_email_delivery()
+    bench_order_serialization()
+    bench_archive_formats()
+    bench_barcode_lookup()
+    bench_render_workers()
@@ -4,16 +4,24 @@ import time
 import os
 import io
 import zipfile
+import tarfile
 import base64
 from dotenv import load_dotenv
 import sys
 import uuid
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+from pathlib import Path
+import zstandard
 
 # Load environment variables from frontend/.env to get the backend URL
 load_dotenv("frontend/.env")
 BACKEND_URL = os.environ.get("REACT_APP_BACKEND_URL")
 API_BASE_URL = f"{BACKEND_URL}/api"
 
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
 print(f"Testing backend API at: {API_BASE_URL}")
 
 # Test results tracking
@@ -406,6 +414,713 @@ def test_order_processing_api(order_id):
     else:
         log_test("Order Processing - Status Check", False, "Failed to check order status after processing")
 
+def read_sse_event(lines):
+    """Read the next event from an iterator over Server-Sent Events lines"""
+    event = {}
+    for line in lines:
+        if not line:
+            if "event" in event:
+                return event
+            continue
+        field, _, value = line.partition(": ")
+        if field in ("event", "data"):
+            event[field] = value
+    return None
+
+def test_order_events_api(order_id):
+    """Test the order status Server-Sent Events stream"""
+    print("\n=== Testing Order Events API ===")
+    
+    if not order_id:
+        log_test("Order Events", False, "No order ID available for testing")
+        return
+    
+    # Test 1: The stream starts with a status snapshot of the order
+    response = requests.get(f"{API_BASE_URL}/order/{order_id}/events", stream=True, timeout=(5, 3))
+    try:
+        if response.status_code != 200:
+            log_test("Order Events - Snapshot", False, f"Expected status code 200, got {response.status_code}")
+            return
+        lines = response.iter_lines(decode_unicode=True)
+        event = read_sse_event(lines)
+        data = json.loads(event["data"]) if event else {}
+        if event and event["event"] == "status" and data.get("id") == order_id and "order_status" in data:
+            log_test("Order Events - Snapshot", True, f"Received status event: {data['order_status']}")
+        else:
+            log_test("Order Events - Snapshot", False, f"Unexpected first event: {event}")
+        
+        # Test 2: A final snapshot does not end the stream, the order may be processed again
+        if data.get("order_status") in ("completed", "failed"):
+            try:
+                next_event = read_sse_event(lines)
+                log_test("Order Events - Final Snapshot", False, f"Stream ended or sent {next_event} right after the snapshot")
+            except requests.exceptions.RequestException:
+                log_test("Order Events - Final Snapshot", True, "Stream stays open after a final snapshot")
+    finally:
+        response.close()
+    
+    # Test 3: Unknown orders are rejected
+    response = requests.get(f"{API_BASE_URL}/order/{uuid.uuid4()}/events", timeout=5)
+    if response.status_code == 404:
+        log_test("Order Events - Invalid ID", True, "Correctly returned 404 for unknown order")
+    else:
+        log_test("Order Events - Invalid ID", False, f"Expected status code 404, got {response.status_code}")
+
+def read_archive_entries(content, content_type):
+    """Return {name: data} for a downloaded ZIP or tar.zst archive"""
+    if content_type == "application/zstd":
+        entries = {}
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(content)) as stream:
+            with tarfile.open(fileobj=stream, mode="r|") as tar_file:
+                for member in tar_file:
+                    if member.isfile():
+                        entries[member.name] = tar_file.extractfile(member).read()
+        return entries
+    with zipfile.ZipFile(io.BytesIO(content)) as zip_file:
+        return {name: zip_file.read(name) for name in zip_file.namelist()}
+
+def test_archive_formats_api(order_id):
+    """Test archive format negotiation and the contents of every archive format"""
+    print("\n=== Testing Archive Formats API ===")
+    
+    if not order_id:
+        log_test("Archive Formats", False, "No order ID available for testing")
+        return
+    
+    download_url = f"{API_BASE_URL}/order/{order_id}/download"
+    expected_media_types = {
+        "zip-deflate": "application/zip",
+        "zip-stored": "application/zip",
+        "tar.zst": "application/zstd"
+    }
+    
+    # Test 1: Every format keeps the barcode_data.xlsx / invoice.json / barcodes/ layout
+    for archive_format, media_type in expected_media_types.items():
+        name = f"Archive Formats - {archive_format} Layout"
+        response = requests.get(download_url, params={"format": archive_format})
+        if response.status_code != 200:
+            log_test(name, False, f"Expected status code 200, got {response.status_code}")
+            continue
+        content_type = response.headers.get("Content-Type")
+        if content_type != media_type:
+            log_test(name, False, f"Expected {media_type}, got {content_type}")
+            continue
+        try:
+            entries = read_archive_entries(response.content, content_type)
+        except Exception as e:
+            log_test(name, False, f"Could not read archive: {e}")
+            continue
+    
+        barcode_files = [n for n in entries if n.startswith("barcodes/") and n.endswith(".png")]
+        unexpected = [n for n in entries if n not in ("barcode_data.xlsx", "invoice.json") and n not in barcode_files]
+        if "barcode_data.xlsx" not in entries or "invoice.json" not in entries or not barcode_files:
+            log_test(name, False, f"Missing entries, archive contains: {sorted(entries)[:5]}")
+        elif unexpected:
+            log_test(name, False, f"Unexpected entries: {unexpected[:5]}")
+        elif json.loads(entries["invoice.json"]).get("order_id") != order_id:
+            log_test(name, False, "Invoice has incorrect or missing order ID")
+        else:
+            log_test(name, True, f"Excel file, invoice and {len(barcode_files)} barcode images present")
+    
+        if archive_format == "zip-stored":
+            with zipfile.ZipFile(io.BytesIO(response.content)) as zip_file:
+                stored = all(info.compress_type == zipfile.ZIP_STORED for info in zip_file.infolist())
+            log_test("Archive Formats - zip-stored Compression", stored,
+                     "All entries stored" if stored else "Found compressed entries in zip-stored archive")
+    
+    # Test 2: Accept header negotiation honours q-values
+    accept_cases = [
+        ("application/zstd", "application/zstd"),
+        ("application/zstd;q=0.5, application/zip;q=0.9", "application/zip"),
+        ("application/zip;q=0.2, application/zstd", "application/zstd"),
+        ("application/zstd;q=0, text/html", "application/zip"),  # falls back to the stored ZIP
+    ]
+    for accept, expected in accept_cases:
+        response = requests.get(download_url, headers={"Accept": accept})
+        content_type = response.headers.get("Content-Type")
+        if response.status_code == 200 and content_type == expected:
+            log_test("Archive Formats - Accept Negotiation", True, f"'{accept}' -> {content_type}")
+        else:
+            log_test("Archive Formats - Accept Negotiation", False,
+                     f"'{accept}': expected 200 {expected}, got {response.status_code} {content_type}")
+    
+    # Test 3: The format parameter takes priority over the Accept header
+    response = requests.get(download_url, params={"format": "zip-stored"}, headers={"Accept": "application/zstd"})
+    content_type = response.headers.get("Content-Type")
+    if response.status_code == 200 and content_type == "application/zip":
+        log_test("Archive Formats - Format Parameter Priority", True, "format=zip-stored overrides Accept")
+    else:
+        log_test("Archive Formats - Format Parameter Priority", False,
+                 f"Expected 200 application/zip, got {response.status_code} {content_type}")
+    
+    # Test 4: Unknown formats are rejected
+    response = requests.get(download_url, params={"format": "rar"})
+    if response.status_code == 400:
+        log_test("Archive Formats - Invalid Format", True, "Correctly rejected unknown archive format")
+    else:
+        log_test("Archive Formats - Invalid Format", False, f"Expected status code 400, got {response.status_code}")
+
+def load_server_module():
+    """Import backend/server.py to check its helpers directly; they never touch the database"""
+    load_dotenv(os.path.join(BACKEND_DIR, ".env"))
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "barcode_test")
+    sys.path.insert(0, BACKEND_DIR)
+    import server
+    return server
+
+def backend_database():
+    """The database of the tested backend, configured by backend/.env"""
+    from pymongo import MongoClient
+    load_dotenv(os.path.join(BACKEND_DIR, ".env"))
+    return MongoClient(os.environ["MONGO_URL"])[os.environ["DB_NAME"]]
+
+def run_backend_script(*args, timeout=600):
+    """Run a script from the backend directory, as it is run in deployment"""
+    return subprocess.run([sys.executable, *args], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=timeout)
+
+def test_barcode_text_rendering():
+    """Test that the cached text renderer draws exactly what the stock ImageWriter draws"""
+    print("\n=== Testing Barcode Text Rendering ===")
+    
+    from barcode.writer import ImageWriter
+    from PIL import Image, ImageChops
+    server = load_server_module()
+    renderer = server.BarcodeRenderer()
+    
+    # Odd and even text widths, spaces and punctuation, against each symbology's text layout
+    samples = {
+        "code128": ["A", "AB", "Order 42-x", "3f2b9c1e-77aa-4d0e-9b1c-5e6f7a8b9c0d"],
+        "code39": ["A", "AB", "CODE-39 TEST", "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"],
+        "ean13": ["400638133393", "590123412345"],
+        "upc": ["03600029145", "01234567890"],
+    }
+    for barcode_type, code_class in renderer.symbologies.items():
+        different = []
+        for data in samples.get(barcode_type, ["A", "AB", "Order 42-x"]):
+            cached = Image.open(io.BytesIO(renderer.render(data, barcode_type))).convert("L")
+            buffer = io.BytesIO()
+            code_class(data, writer=ImageWriter()).write(buffer)
+            stock = Image.open(buffer).convert("L")
+            if cached.size != stock.size or ImageChops.difference(cached, stock).getbbox() is not None:
+                different.append(data)
+        if different:
+            log_test(f"Text Rendering - {barcode_type}", False, f"Images differ from ImageWriter for {different}")
+        else:
+            log_test(f"Text Rendering - {barcode_type}", True, "Images identical to ImageWriter")
+
+def test_render_pool():
+    """Test that the render process pool keeps barcodes in order and recovers from a dead worker"""
+    print("\n=== Testing Render Pool ===")
+    
+    import asyncio
+    from concurrent.futures.process import BrokenProcessPool
+    server = load_server_module()
+    
+    barcode_list = server.generate_barcode_data("code128", 3 * server.RENDER_BATCH_SIZE + 5)
+    expected = [server.render_barcode_png(bc["data"], bc["type"]) for bc in barcode_list]
+    
+    async def render():
+        return [(bc["id"], png) async for bc, png in server.render_barcodes(barcode_list)]
+    
+    def check(name):
+        try:
+            rendered = asyncio.run(render())
+        except BrokenProcessPool as e:
+            log_test(name, False, f"Rendering failed: {e!r}")
+            return
+        ids = [barcode_id for barcode_id, _ in rendered]
+        if ids == [bc["id"] for bc in barcode_list] and [png for _, png in rendered] == expected:
+            log_test(name, True, f"{len(rendered)} images rendered by 2 workers, in order")
+        else:
+            log_test(name, False, "Images are missing, out of order or differ from in-process rendering")
+    
+    original_workers = server.RENDER_WORKERS
+    server.shutdown_render_pool()
+    server.RENDER_WORKERS = 2
+    try:
+        # Test 1: Batches finishing out of order are still yielded in order
+        check("Render Pool - Order")
+        
+        # Test 2: A worker dying breaks the pool; the failed order releases it and the next one gets a new pool
+        broken_pool = server.get_render_pool()
+        broken_pool.submit(os._exit, 1).exception()
+        try:
+            asyncio.run(render())
+            log_test("Render Pool - Broken Pool", False, "Rendering on a broken pool did not fail")
+        except BrokenProcessPool:
+            log_test("Render Pool - Broken Pool", True, "BrokenProcessPool raised for the running order")
+        if server.render_pool is not None:
+            log_test("Render Pool - Recovery", False, "Broken pool was not released")
+            return
+        check("Render Pool - Recovery")
+    finally:
+        server.shutdown_render_pool()
+        server.RENDER_WORKERS = original_workers
+
+def order_barcode_ids(order_id):
+    """Barcode IDs of an order, read from the image names in its downloaded archive"""
+    response = requests.get(f"{API_BASE_URL}/order/{order_id}/download", params={"format": "zip-stored"})
+    if response.status_code != 200:
+        return []
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zip_file:
+        return [name[len("barcodes/"):-len(".png")] for name in zip_file.namelist() if name.startswith("barcodes/")]
+
+def test_barcode_lookup_api(order_id):
+    """Test the order manifest and barcode lookup APIs, including regenerated orders"""
+    print("\n=== Testing Barcode Lookup API ===")
+    
+    if not order_id:
+        log_test("Barcode Lookup", False, "No order ID available for testing")
+        return
+    
+    # Test 1: The order manifest is a Parquet file
+    response = requests.get(f"{API_BASE_URL}/order/{order_id}/manifest")
+    if response.status_code == 200 and response.content[:4] == b"PAR1":
+        log_test("Order Manifest", True, "Parquet manifest available")
+    else:
+        log_test("Order Manifest", False, f"Expected a Parquet file, got status code {response.status_code}")
+    
+    response = requests.get(f"{API_BASE_URL}/order/{uuid.uuid4()}/manifest")
+    if response.status_code == 404:
+        log_test("Order Manifest - Invalid ID", True, "Correctly returned 404 for unknown order")
+    else:
+        log_test("Order Manifest - Invalid ID", False, f"Expected status code 404, got {response.status_code}")
+    
+    # Test 2: Every barcode of the order resolves to it
+    old_ids = order_barcode_ids(order_id)
+    if not old_ids:
+        log_test("Barcode Lookup", False, "Could not read barcode IDs of the processed order")
+        return
+    wrong = [b for b in old_ids if requests.get(f"{API_BASE_URL}/lookup/{b}").json().get("order_id") != order_id]
+    log_test("Barcode Lookup - Known IDs", not wrong,
+             f"All {len(old_ids)} barcodes resolve to the order" if not wrong else f"Wrong owner for {wrong[:3]}")
+    
+    response = requests.get(f"{API_BASE_URL}/lookup/UNKNOWN{uuid.uuid4().hex[:8]}")
+    if response.status_code == 404:
+        log_test("Barcode Lookup - Unknown ID", True, "Correctly returned 404 for unknown barcode")
+    else:
+        log_test("Barcode Lookup - Unknown ID", False, f"Expected status code 404, got {response.status_code}")
+    
+    # Test 3: Regenerating the order retires its old barcode IDs
+    response = requests.post(f"{API_BASE_URL}/process-order/{order_id}")
+    if response.status_code != 200:
+        log_test("Barcode Lookup - Regenerated Order", False, f"Reprocessing failed with {response.status_code}")
+        return
+    new_ids = order_barcode_ids(order_id)
+    stale = [b for b in old_ids if requests.get(f"{API_BASE_URL}/lookup/{b}").status_code != 404]
+    missing = [b for b in new_ids if requests.get(f"{API_BASE_URL}/lookup/{b}").json().get("order_id") != order_id]
+    if stale or missing:
+        log_test("Barcode Lookup - Regenerated Order", False, f"Stale IDs found: {stale[:3]}, new IDs missing: {missing[:3]}")
+    else:
+        log_test("Barcode Lookup - Regenerated Order", True, "Old IDs return 404 and new IDs resolve to the order")
+
+def test_barcode_index_compaction():
+    """Test that regenerated orders' old IDs stay retired before and after index compaction"""
+    print("\n=== Testing Barcode Index Compaction ===")
+    
+    server = load_server_module()
+    index = server.BarcodeIndex(Path(tempfile.mkdtemp(prefix="barcode_index_")))
+    
+    def segment_count():
+        return len(json.loads(index.state_path.read_text())["segments"])
+    
+    old_ids = [f"OLD{i}" for i in range(10)]
+    new_ids = [f"NEW{i}" for i in range(3)]
+    other_ids = [f"OTHER{i}" for i in range(10)]
+    index.add_order("order-a", old_ids)
+    index.add_order("order-a", new_ids)  # regenerated with a smaller segment, not merged yet
+    
+    def check(stage):
+        stale = [b for b in old_ids if index.lookup(b) is not None]
+        missing = [b for b in new_ids if index.lookup(b) != "order-a"]
+        if stale or missing:
+            log_test(f"Barcode Index - {stage}", False, f"Stale IDs: {stale[:3]}, missing IDs: {missing[:3]}")
+        else:
+            log_test(f"Barcode Index - {stage}", True, "Only the regenerated IDs resolve to the order")
+    
+    if segment_count() != 2:
+        log_test("Barcode Index - Before Compaction", False, f"Expected 2 segments, found {segment_count()}")
+    check("Before Compaction")
+    
+    index.add_order("order-b", other_ids)  # comparable size, merges every segment
+    if segment_count() != 1:
+        log_test("Barcode Index - After Compaction", False, f"Expected 1 segment, found {segment_count()}")
+    check("After Compaction")
+    if all(index.lookup(b) == "order-b" for b in other_ids):
+        log_test("Barcode Index - Other Orders", True, "Other orders survive compaction")
+    else:
+        log_test("Barcode Index - Other Orders", False, "IDs of another order were lost in compaction")
+
+def create_test_order(barcode_type, quantity, state="Gujarat"):
+    """Create an order for the given barcode type and return its ID"""
+    customer_data = {
+        "name": "Priya",
+        "surname": "Shah",
+        "organization": "XYZ Retail",
+        "country": "India",
+        "address": "45 Ring Road, Surat",
+        "phone": "9876501234",
+        "email": "priya.shah@example.com",
+        "state": state
+    }
+    response = requests.post(f"{API_BASE_URL}/create-order", json={
+        "customer_details": customer_data,
+        "barcode_type": barcode_type,
+        "quantity": quantity
+    })
+    if response.status_code != 200:
+        return None
+    return response.json()["order_id"]
+
+def upload_payloads(order_id, filename, content):
+    """Upload a payload file for an order"""
+    return requests.post(f"{API_BASE_URL}/order/{order_id}/payloads", files={"file": (filename, content)})
+
+def test_gtin_check_digits():
+    """Test the vectorised GTIN check digit and payload validation helpers"""
+    print("\n=== Testing GTIN Check Digits ===")
+    
+    import numpy as np
+    import pandas as pd
+    server = load_server_module()
+    
+    # Known GTINs: EAN-13 4006381333931, UPC-A 036000291452 and 012345678905
+    payloads = ["400638133393", "03600029145", "01234567890"]
+    digits = np.array([[int(d) for d in p.zfill(12)] for p in payloads])
+    check_digits = server.gtin_check_digits(digits).tolist()
+    if check_digits == [1, 2, 5]:
+        log_test("GTIN Check Digits", True, "Check digits match known GTINs")
+    else:
+        log_test("GTIN Check Digits", False, f"Expected [1, 2, 5], got {check_digits}")
+    
+    values = pd.Series(["036000291452", "036000291453", "03600029145", "3600029145", 36000291452, ""],
+                       index=range(2, 8), dtype=object)
+    _, errors = server.validate_payload_batch("upc", values)
+    invalid_rows = errors.index[errors.notna()].tolist()
+    if invalid_rows == [3, 5, 6, 7] and "leading zeros" in errors[6]:
+        log_test("GTIN Payload Validation", True, "Wrong check digit, length, numeric cell and empty rows rejected")
+    else:
+        log_test("GTIN Payload Validation", False, f"Unexpected invalid rows {invalid_rows}: {errors.tolist()}")
+
+def test_payload_upload_api():
+    """Test uploading customer payloads from CSV and XLSX files"""
+    print("\n=== Testing Payload Upload API ===")
+    
+    from openpyxl import Workbook
+    
+    order_id = create_test_order("ean13", 3)
+    if not order_id:
+        log_test("Payload Upload", False, "Could not create an EAN-13 order")
+        return
+    
+    # Test 1: Invalid rows are reported with their spreadsheet row numbers
+    csv_data = "sku,name\n4006381333931,Valid\n4006381333932,Bad check digit\n\n40063813339,Too short\n"
+    response = upload_payloads(order_id, "payloads.csv", csv_data.encode())
+    if response.status_code != 422:
+        log_test("Payload Upload - Invalid Rows", False, f"Expected status code 422, got {response.status_code}")
+    else:
+        errors = {e["row"]: e["error"] for e in response.json()["errors"]}
+        if errors.get(3) == "invalid check digit" and 5 in errors and 2 not in errors and 4 not in errors:
+            log_test("Payload Upload - Invalid Rows", True, "Check digit and length errors reported on rows 3 and 5")
+        else:
+            log_test("Payload Upload - Invalid Rows", False, f"Unexpected row errors: {errors}")
+    
+    # Test 2: The row count must match the ordered quantity
+    response = upload_payloads(order_id, "payloads.csv", b"data\n4006381333931\n400638133393\n")
+    data = response.json()
+    if response.status_code == 422 and data["accepted"] == 2 and data["rejected"] == 0:
+        log_test("Payload Upload - Quantity Mismatch", True, "Rejected 2 rows for an order of 3 barcodes")
+    else:
+        log_test("Payload Upload - Quantity Mismatch", False, f"Expected 422 with 2 accepted rows, got {response.status_code} {data}")
+    
+    # Test 3: XLSX numbers lose leading zeros, so numeric GTIN cells are rejected
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["data"])
+    ws.append([4006381333931])
+    ws.append(["5901234123457"])
+    ws.append(["400638133393"])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    response = upload_payloads(order_id, "payloads.xlsx", buffer.getvalue())
+    errors = {e["row"]: e["error"] for e in response.json().get("errors", [])}
+    if response.status_code == 422 and list(errors) == [2] and "text" in errors[2]:
+        log_test("Payload Upload - XLSX Numeric Cells", True, "Numeric GTIN cell rejected on row 2")
+    else:
+        log_test("Payload Upload - XLSX Numeric Cells", False, f"Expected a row 2 error, got {response.status_code} {errors}")
+    
+    # Test 4: A valid XLSX file is imported and encoded by the order
+    ws["A2"] = "4006381333931"
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    response = upload_payloads(order_id, "payloads.xlsx", buffer.getvalue())
+    if response.status_code != 200 or not response.json().get("imported"):
+        log_test("Payload Upload - XLSX Import", False, f"Expected status code 200, got {response.status_code} {response.text}")
+        return
+    order = requests.get(f"{API_BASE_URL}/order/{order_id}").json()
+    log_test("Payload Upload - XLSX Import", order.get("payload_source") == "upload",
+             f"Order payload source is {order.get('payload_source')}")
+    
+    # Test 5: Unsupported file types are rejected
+    response = upload_payloads(order_id, "payloads.txt", b"data\n")
+    if response.status_code == 400:
+        log_test("Payload Upload - File Type", True, "Correctly rejected a .txt upload")
+    else:
+        log_test("Payload Upload - File Type", False, f"Expected status code 400, got {response.status_code}")
+
+def test_email_delivery():
+    """Test order emails and the pooled email worker against a local SMTP server"""
+    print("\n=== Testing Email Delivery ===")
+    
+    import asyncio
+    import logging
+    from aiosmtpd.controller import Controller
+    server = load_server_module()
+    logging.getLogger("mail.log").setLevel(logging.WARNING)
+    
+    class RecordingHandler:
+        """Accepts mail, failing transient@ once with a 4xx and always rejecting reject@ with a 5xx"""
+        def __init__(self):
+            self.messages = []
+            self.transient_failures = 1
+        
+        async def handle_DATA(self, smtp_server, session, envelope):
+            recipient = envelope.rcpt_tos[0]
+            if recipient.startswith("transient@") and self.transient_failures:
+                self.transient_failures -= 1
+                return "451 Try again later"
+            if recipient.startswith("reject@"):
+                return "550 Mailbox unavailable"
+            self.messages.append(envelope)
+            return "250 OK"
+    
+    archive = Path(tempfile.mkdtemp(prefix="barcode_email_")) / "barcodes_test.zip"
+    archive.write_bytes(b"PK" + b"\0" * 1022)
+    
+    # Test 1: Archives up to EMAIL_ATTACHMENT_LIMIT are attached, larger ones linked
+    job = {"order_id": "order-1", "to": "customer@example.com", "name": "Priya", "archive_path": str(archive)}
+    original_limit, original_base_url = server.EMAIL_ATTACHMENT_LIMIT, server.PUBLIC_BASE_URL
+    try:
+        server.PUBLIC_BASE_URL = "https://barcodes.example.com"
+        server.EMAIL_ATTACHMENT_LIMIT = archive.stat().st_size
+        attached = server.build_order_email(job)
+        server.EMAIL_ATTACHMENT_LIMIT = archive.stat().st_size - 1
+        linked = server.build_order_email(job)
+    finally:
+        server.EMAIL_ATTACHMENT_LIMIT, server.PUBLIC_BASE_URL = original_limit, original_base_url
+    attachments = [part.get_filename() for part in attached.walk() if part.get_filename()]
+    if attachments == [archive.name]:
+        log_test("Email Delivery - Attachment", True, "Archive at the size limit is attached")
+    else:
+        log_test("Email Delivery - Attachment", False, f"Expected {archive.name} attached, got {attachments}")
+    link_body = linked.get_payload()[0].get_payload()
+    has_attachment = any(part.get_filename() for part in linked.walk())
+    if not has_attachment and "https://barcodes.example.com/api/order/order-1/download" in link_body:
+        log_test("Email Delivery - Download Link", True, "Archive over the size limit is linked with an absolute URL")
+    else:
+        log_test("Email Delivery - Download Link", False, f"Unexpected large archive email: {link_body!r}")
+    
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=8026)
+    controller.start()
+    try:
+        pool = server.SMTPConnectionPool("127.0.0.1", 8026, use_tls=False, size=2)
+        
+        async def deliver(recipients, retry_base_delay, stop_early=False):
+            results = {}
+            
+            async def record(job, error):
+                results[job["to"]] = (job["attempt"], error)
+            
+            worker = server.EmailDeliveryWorker(
+                pool, server.build_order_email, record, batch_window=0.01, retry_base_delay=retry_base_delay
+            )
+            worker.start()
+            for recipient in recipients:
+                worker.enqueue(dict(job, to=recipient))
+            if not stop_early:
+                for _ in range(200):
+                    if len(results) == len(recipients):
+                        break
+                    await asyncio.sleep(0.05)
+            else:
+                await asyncio.sleep(0.5)
+            await worker.stop(timeout=10)
+            return results
+        
+        # Test 2: A transient 4xx is retried, a permanent 5xx is not
+        results = asyncio.run(deliver(["transient@example.com", "reject@example.com"], retry_base_delay=0.05))
+        attempts, error = results.get("transient@example.com", (None, "no result"))
+        if attempts == 2 and error is None:
+            log_test("Email Delivery - Transient Failure", True, "Delivered on the second attempt after a 451")
+        else:
+            log_test("Email Delivery - Transient Failure", False, f"Got attempt {attempts}, error {error}")
+        attempts, error = results.get("reject@example.com", (None, None))
+        if attempts == 1 and getattr(error, "smtp_code", None) == 550:
+            log_test("Email Delivery - Permanent Failure", True, "550 reported without retrying")
+        else:
+            log_test("Email Delivery - Permanent Failure", False, f"Got attempt {attempts}, error {error}")
+        
+        # Test 3: stop() sends queued jobs and pending retries instead of dropping them
+        handler.transient_failures = 1
+        handler.messages.clear()
+        recipients = ["transient@example.com"] + [f"customer{i}@example.com" for i in range(5)]
+        results = asyncio.run(deliver(recipients, retry_base_delay=60, stop_early=True))
+        delivered = [to for to, (_, error) in results.items() if error is None]
+        if len(delivered) == len(recipients) and len(handler.messages) == len(recipients):
+            log_test("Email Delivery - Drain On Stop", True, f"All {len(recipients)} messages sent, retry included")
+        else:
+            log_test("Email Delivery - Drain On Stop", False,
+                     f"{len(delivered)} of {len(recipients)} delivered, server received {len(handler.messages)}")
+    finally:
+        controller.stop()
+
+def test_distributed_processing():
+    """Test chunked processing by chunk_worker.py, including chunks left behind by a dead worker"""
+    print("\n=== Testing Distributed Processing ===")
+    
+    quantity = 25
+    order_id = create_test_order("code128", quantity)
+    if not order_id:
+        log_test("Distributed Processing", False, "Could not create an order for testing")
+        return
+    
+    # Test 1: The order is split into chunks
+    response = requests.post(f"{API_BASE_URL}/process-order/{order_id}/distributed", params={"chunk_size": 10})
+    if response.status_code == 202 and response.json().get("chunks") == 3:
+        log_test("Distributed Processing - Queued", True, "Order split into 3 chunks")
+    else:
+        log_test("Distributed Processing - Queued", False, f"Unexpected response {response.status_code}: {response.text}")
+        return
+    
+    # Leave the first chunk running under the expired lease of a worker that died
+    backend_database().order_chunks.update_one(
+        {"order_id": order_id, "index": 0},
+        {"$set": {
+            "status": "running",
+            "lease_owner": "dead-worker",
+            "lease_expires": datetime.utcnow() - timedelta(seconds=1),
+            "attempts": 1
+        }}
+    )
+    
+    result = run_backend_script("chunk_worker.py", "--processes", "2", "--exit-when-idle")
+    if result.returncode != 0:
+        log_test("Distributed Processing - Workers", False, f"chunk_worker.py failed: {result.stderr[-500:]}")
+        return
+    
+    # Test 2: The order completes, which needs the expired chunk to be reclaimed
+    order = requests.get(f"{API_BASE_URL}/order/{order_id}").json()
+    if order.get("order_status") == "completed" and order.get("progress") == quantity:
+        log_test("Distributed Processing - Completed", True, f"Order completed with progress {quantity}")
+        log_test("Distributed Processing - Expired Lease", True, "Chunk of the dead worker was reclaimed")
+    else:
+        log_test("Distributed Processing - Completed", False,
+                 f"Got status {order.get('order_status')}, progress {order.get('progress')}")
+        return
+    
+    # Test 3: The merged archive holds every barcode once, with the workbook and invoice
+    response = requests.get(f"{API_BASE_URL}/order/{order_id}/download")
+    if response.status_code != 200:
+        log_test("Distributed Processing - Archive", False, f"Download failed with {response.status_code}")
+        return
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zip_file:
+        names = zip_file.namelist()
+    images = [n for n in names if n.startswith("barcodes/") and n.endswith(".png")]
+    others = sorted(n for n in names if not n.startswith("barcodes/"))
+    if len(images) == len(set(images)) == quantity and others == ["barcode_data.xlsx", "invoice.json"]:
+        log_test("Distributed Processing - Archive", True, f"Merged archive has {quantity} PNGs, workbook and invoice")
+    else:
+        log_test("Distributed Processing - Archive", False, f"Found {len(images)} PNGs and {others}")
+
+def test_analytics_api():
+    """Test the sales analytics API, its rollup counters and the rollup backfill"""
+    print("\n=== Testing Analytics API ===")
+    
+    # A state no other order uses, so the counters below only see this order
+    state = f"Test State {uuid.uuid4().hex[:8]}"
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    
+    def state_totals(**params):
+        response = requests.get(f"{API_BASE_URL}/analytics", params=dict({"state": state}, **params))
+        if response.status_code != 200:
+            return None
+        return response.json()["totals"]
+    
+    def check_counters(name, expected, **params):
+        totals = state_totals(**params)
+        if totals is None:
+            log_test(name, False, "Analytics request failed")
+            return
+        actual = {counter: totals[counter] for counter in expected}
+        if actual == expected:
+            log_test(name, True, f"Counters match: {expected}")
+        else:
+            log_test(name, False, f"Expected {expected}, got {actual}")
+    
+    order_id = create_test_order("code128", 5, state=state)
+    if not order_id:
+        log_test("Analytics", False, "Could not create an order for testing")
+        return
+    
+    # Test 1: Creating an order counts it as ordered, not completed
+    check_counters("Analytics - Created Order", {"orders": 1, "units": 5, "completed_orders": 0, "completed_units": 0})
+    
+    # Test 2: Processing the order counts it as completed
+    response = requests.post(f"{API_BASE_URL}/process-order/{order_id}")
+    if response.status_code != 200:
+        log_test("Analytics - Completed Order", False, f"Processing failed with {response.status_code}")
+        return
+    check_counters("Analytics - Completed Order", {"orders": 1, "units": 5, "completed_orders": 1, "completed_units": 5})
+    
+    # Test 3: Grouping and date filters
+    response = requests.get(f"{API_BASE_URL}/analytics", params={"state": state, "group_by": "state,barcode_type"})
+    groups = response.json().get("groups") if response.status_code == 200 else None
+    expected_group = {"state": state.lower(), "barcode_type": "code128"}
+    if groups and len(groups) == 1 and {k: groups[0].get(k) for k in expected_group} == expected_group \
+            and "day" not in groups[0]:
+        log_test("Analytics - Group By", True, "Grouped by state and barcode type only")
+    else:
+        log_test("Analytics - Group By", False, f"Unexpected groups: {groups}")
+    
+    check_counters("Analytics - Date Range", {"orders": 1, "completed_orders": 1}, start=today, end=today)
+    tomorrow = (datetime.utcnow() + timedelta(days=1)).strftime("%Y-%m-%d")
+    check_counters("Analytics - Date Range Excluded", {"orders": 0, "completed_orders": 0}, start=tomorrow)
+    
+    # Test 4: Invalid dimensions and dates are rejected
+    for name, params in (("Invalid Dimension", {"group_by": "day,color"}), ("Invalid Date", {"start": "19-10-2026"})):
+        response = requests.get(f"{API_BASE_URL}/analytics", params=params)
+        if response.status_code == 400:
+            log_test(f"Analytics - {name}", True, "Correctly rejected with 400")
+        else:
+            log_test(f"Analytics - {name}", False, f"Expected status code 400, got {response.status_code}")
+    
+    # Test 5: A reprocessed order is not counted as completed twice
+    response = requests.post(f"{API_BASE_URL}/process-order/{order_id}")
+    if response.status_code != 200:
+        log_test("Analytics - Reprocessed Order", False, f"Reprocessing failed with {response.status_code}")
+        return
+    check_counters("Analytics - Reprocessed Order", {"completed_orders": 1, "completed_units": 5})
+    
+    # Test 6: The backfill dates completed orders without completed_at by updated_at and stores it,
+    # so reprocessing them afterwards does not count them again
+    orders = backend_database().barcode_orders
+    orders.update_one({"id": order_id}, {"$unset": {"completed_at": ""}})
+    result = run_backend_script("backfill_rollups.py")
+    if result.returncode != 0:
+        log_test("Analytics - Backfill", False, f"backfill_rollups.py failed: {result.stderr[-500:]}")
+        return
+    order = orders.find_one({"id": order_id}, {"completed_at": 1, "updated_at": 1})
+    if order.get("completed_at") == order["updated_at"]:
+        log_test("Analytics - Backfill Completion Date", True, "completed_at stored from updated_at")
+    else:
+        log_test("Analytics - Backfill Completion Date", False, f"Unexpected completed_at: {order.get('completed_at')}")
+    check_counters("Analytics - Backfill", {"orders": 1, "units": 5, "completed_orders": 1, "completed_units": 5})
+    
+    requests.post(f"{API_BASE_URL}/process-order/{order_id}")
+    check_counters("Analytics - Reprocessed After Backfill", {"completed_orders": 1, "completed_units": 5})
+
 def test_orders_listing_api():
     """Test the orders listing API"""
     print("\n=== Testing Orders Listing API ===")
@@ -460,6 +1175,33 @@ def main():
     # Test order processing API
     test_order_processing_api(order_id)
     
+    # Test order status events of the processed order
+    test_order_events_api(order_id)
+    
+    # Test archive formats of the processed order
+    test_archive_formats_api(order_id)
+    
+    # Test barcode rendering against the stock writer and on the render pool
+    test_barcode_text_rendering()
+    test_render_pool()
+    
+    # Test barcode lookups, regenerating the processed order
+    test_barcode_lookup_api(order_id)
+    test_barcode_index_compaction()
+    
+    # Test customer payload uploads
+    test_gtin_check_digits()
+    test_payload_upload_api()
+    
+    # Test email delivery against a local SMTP server
+    test_email_delivery()
+    
+    # Test distributed processing with chunk_worker.py processes
+    test_distributed_processing()
+    
+    # Test sales analytics and the rollup backfill
+    test_analytics_api()
+    
     # Test orders listing API
     test_orders_listing_api()
     
@@ -27,6 +27,7 @@ const BarcodeGeneratorApp = () => {
   const [pricing, setPricing] = useState(null);
   const [order, setOrder] = useState(null);
   const [loading, setLoading] = useState(false);
+  const [progress, setProgress] = useState(null);
 
   useEffect(() => {
     fetchBarcodeTypes();
@@ -107,6 +108,22 @@ const BarcodeGeneratorApp = () => {
     if (!order) return;
     
     setLoading(true);
+    // Follow generation progress pushed by the server while the download is prepared
+    const events = new EventSource(`${API}/order/${order.order_id}/events`);
+    let sawProcessing = false;
+    events.addEventListener('status', (event) => {
+      const status = JSON.parse(event.data);
+      if (status.order_status === 'processing') {
+        sawProcessing = true;
+      } else if (!sawProcessing) {
+        // State from before this run started (pending, or a previous run's result)
+        return;
+      }
+      setProgress({ done: status.progress || 0, total: status.quantity });
+      if (status.order_status === 'completed' || status.order_status === 'failed') {
+        events.close();
+      }
+    });
     try {
       const response = await axios.post(`${API}/process-order/${order.order_id}`, {}, {
         responseType: 'blob'
@@ -127,6 +144,8 @@ const BarcodeGeneratorApp = () => {
       console.error('Error processing order:', error);
       alert('Failed to generate barcodes. Please try again.');
     } finally {
+      events.close();
+      setProgress(null);
       setLoading(false);
     }
   };
@@ -622,7 +641,10 @@ const BarcodeGeneratorApp = () => {
               {loading ? (
                 <>
                   <div className="loading-indicator"></div>
-                  <span>Generating Barcodes...</span>
+                  <span>
+                    Generating Barcodes...
+                    {progress && progress.total ? ` ${progress.done}/${progress.total}` : ''}
+                  </span>
                 </>
               ) : (
                 <>